@@ -0,0 +1,276 @@
+"""The account store: accounts.csv, plus an index of it and a journal of changes"""
+import json
+import io
+import csv
+import os
+
+from instrumentation import metrics
+from storage import get_file, file_lock
+
+# How many journal entries can build up before the accounts are compacted on startup
+JOURNAL_COMPACT_ENTRIES = 1000
+
+
+class AccountStore:
+    """Stores accounts as a snapshot CSV file plus a journal of changes made since the
+    snapshot was last compacted.
+
+    The snapshot is looked up through an index of the byte offset where each account's
+    row starts. The index is saved next to the CSV file (with an .idx extension) and is
+    only rebuilt when the CSV has been changed by something else.
+
+    New accounts and edits are appended to the journal (with a .journal extension), so
+    a write costs the same however many accounts there are. Lookups check the changes
+    read from the journal before falling back to the snapshot, and compact() folds the
+    journal back into the snapshot."""
+
+    def __init__(self, filename):
+        self.filename = os.fspath(filename)
+        self.index_filename = self.filename + ".idx"
+        self.journal_filename = self.filename + ".journal"
+        self.offsets = {}
+        self.file_signature = None
+        # The latest columns of every account that the journal has changed or added
+        self.changes = {}
+        self.journal_entries = 0
+        self.journal_offset = 0
+
+    def current_signature(self):
+        try:
+            stats = os.stat(self.filename)
+        except FileNotFoundError:
+            # Create the file if it doesn't exist
+            get_file(self.filename).close()
+            stats = os.stat(self.filename)
+        return [stats.st_mtime_ns, stats.st_size]
+
+    def refresh(self):
+        with file_lock(self.filename):
+            signature = self.current_signature()
+            if signature != self.file_signature:
+                # A new snapshot means the journal has been folded into it, so the
+                # journal needs to be read again from the start
+                self.changes = {}
+                self.journal_entries = 0
+                self.journal_offset = 0
+                if not self.load_index(signature):
+                    self.build_index()
+                    self.save_index()
+            self.read_journal()
+        return self
+
+    def load_index(self, signature):
+        try:
+            with open(self.index_filename, "r") as index_file:
+                index = json.load(index_file)
+        except (FileNotFoundError, ValueError):
+            return False
+        if index.get("signature") != signature:
+            return False
+        self.offsets = index["offsets"]
+        self.file_signature = signature
+        return True
+
+    def build_index(self):
+        signature = self.current_signature()
+        offsets = {}
+        offset = 0
+        with open(self.filename, "rb") as accounts_csv:
+            for line in accounts_csv:
+                if line.startswith(b'"'):
+                    # The name has been quoted, because it has a comma or a quote in it
+                    name = next(csv.reader([line.decode()]), [""])[0].strip()
+                else:
+                    name = line.split(b",", 1)[0].decode().strip()
+                # Like a linear scan, the first row with a given name wins
+                if name and name not in offsets:
+                    offsets[name] = offset
+                offset += len(line)
+        self.offsets = offsets
+        self.file_signature = signature
+
+    def save_index(self):
+        # Several readers might rebuild the index at once, so each needs its own temporary file
+        temporary_path = f"{self.index_filename}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as index_file:
+            json.dump({"signature": self.file_signature, "offsets": self.offsets}, index_file)
+        os.replace(temporary_path, self.index_filename)
+
+    def read_journal(self):
+        """Applies any journal entries that have been written since we last looked"""
+        try:
+            journal_size = os.path.getsize(self.journal_filename)
+        except FileNotFoundError:
+            journal_size = 0
+        if journal_size < self.journal_offset:
+            # The journal has been compacted by another process, so start again
+            self.changes = {}
+            self.journal_entries = 0
+            self.journal_offset = 0
+        if journal_size == self.journal_offset:
+            return
+
+        with open(self.journal_filename, "rb") as journal:
+            journal.seek(self.journal_offset)
+            tail = journal.read(journal_size - self.journal_offset)
+        # Leave any half-written entry at the end until its writer has finished it
+        complete = tail.rfind(b"\n") + 1
+        for entry in csv.reader(io.StringIO(tail[:complete].decode())):
+            if entry:
+                self.apply_entry(entry)
+                metrics.count("rows read: accounts journal")
+        self.journal_offset += complete
+
+    def apply_entry(self, entry):
+        action, name = entry[0], entry[1]
+        if action == "add":
+            if name not in self.changes and name not in self.offsets:
+                self.changes[name] = entry[1:]
+        elif action == "set":
+            columns = self.changes.get(name) or self.snapshot_row(name)
+            if columns is not None:
+                columns[int(entry[2])] = entry[3]
+                self.changes[name] = columns
+        self.journal_entries += 1
+
+    def append_entry(self, *entry):
+        """Adds an entry to the end of the journal. This should be called while holding
+        the exclusive lock, after the journal has been read up to date."""
+        line = io.StringIO()
+        csv.writer(line, lineterminator="\n").writerow(entry)
+        data = line.getvalue().encode()
+        with open(self.journal_filename, "ab") as journal:
+            if journal.seek(0, os.SEEK_END) > self.journal_offset:
+                # Nobody else can be writing, so anything after the last complete entry
+                # was left by a writer that crashed, and would run into this entry
+                journal.truncate(self.journal_offset)
+                metrics.count("torn journal entries removed")
+            journal.write(data)
+            journal.flush()
+            os.fsync(journal.fileno())
+        metrics.count("bytes written: accounts journal", len(data))
+
+    def snapshot_row(self, username):
+        offset = self.offsets.get(username)
+        if offset is None:
+            return None
+        with open(self.filename, "rb") as accounts_csv:
+            accounts_csv.seek(offset)
+            line = accounts_csv.readline()
+        metrics.count("rows read: accounts")
+        return next(csv.reader([line.decode()]))
+
+    def get_row(self, username):
+        with file_lock(self.filename):
+            self.refresh()
+            columns = self.changes.get(username)
+            if columns is None:
+                columns = self.snapshot_row(username)
+        return columns
+
+    def get(self, username):
+        columns = self.get_row(username)
+        return account_from_row(columns) if columns else None
+
+    def update(self, username, column, value):
+        check_line_breaks([value])
+        with file_lock(self.filename, exclusive=True):
+            columns = self.get_row(username)
+            if columns is None:
+                raise LookupError(f"Account no longer exists in the {self.filename} file!")
+            if len(columns) <= column:
+                raise IndexError(
+                    f"Cannot modify column number {column} in a row with {len(columns)} columns!"
+                )
+            self.append_entry("set", username, column, value)
+            self.read_journal()
+
+    def add(self, *columns):
+        check_line_breaks(columns)
+        with file_lock(self.filename, exclusive=True):
+            self.refresh()
+            self.append_entry("add", *columns)
+            self.read_journal()
+
+    def __iter__(self):
+        """Goes through every account's columns, reading the snapshot one row at a time"""
+        # Compaction replaces the snapshot with a rename, so once the file is open we can
+        # keep reading it without holding the lock
+        with file_lock(self.filename):
+            self.refresh()
+            changes = dict(self.changes)
+            accounts_csv = open(self.filename, "r")
+        seen = set()
+        with accounts_csv:
+            for columns in csv.reader(accounts_csv):
+                if not columns or columns[0] in seen:
+                    continue
+                seen.add(columns[0])
+                yield changes.get(columns[0], columns)
+        for name, columns in changes.items():
+            if name not in seen:
+                yield columns
+
+    def compact(self):
+        """Folds the journal into the snapshot, and then empties the journal"""
+        import tempfile
+        import shutil
+
+        with file_lock(self.filename, exclusive=True):
+            self.refresh()
+            offsets = {}
+            offset = 0
+            directory = os.path.dirname(os.path.abspath(self.filename))
+            temporary_fd, temporary_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            try:
+                with os.fdopen(temporary_fd, "wb") as new_file:
+                    # Rows are quoted like journal entries, so that values with commas or
+                    # quotes in them are read back the same, and the offsets are counted
+                    # from the encoded rows
+                    line = io.StringIO()
+                    writer = csv.writer(line, lineterminator="\n")
+                    for columns in self:
+                        line.seek(0)
+                        line.truncate()
+                        writer.writerow(columns)
+                        row = line.getvalue().encode()
+                        offsets[columns[0]] = offset
+                        new_file.write(row)
+                        offset += len(row)
+                    new_file.flush()
+                    os.fsync(new_file.fileno())
+                metrics.count("bytes written: accounts", offset)
+                shutil.copymode(self.filename, temporary_path)
+                os.replace(temporary_path, self.filename)
+            except BaseException:
+                if os.path.exists(temporary_path):
+                    os.remove(temporary_path)
+                raise
+
+            # If we crash before the journal is emptied, replaying it is harmless, because
+            # "add" entries are skipped for existing accounts and "set" entries overwrite
+            self.offsets = offsets
+            self.file_signature = self.current_signature()
+            self.save_index()
+            open(self.journal_filename, "wb").close()
+            self.changes = {}
+            self.journal_entries = 0
+            self.journal_offset = 0
+
+
+"""Raises a ValueError if any of the values have a line break in them. The snapshot and the
+journal are read one line per row (and a torn last line is told apart by its missing line
+break), so a value that csv.writer quoted across several lines couldn't be read back."""
+def check_line_breaks(values):
+    for value in values:
+        if "\n" in str(value) or "\r" in str(value):
+            raise ValueError(f"Account details can't contain line breaks: {str(value)!r}")
+
+
+def account_from_row(account):
+    return {
+        "name": account[0],
+        "birth_date": account[1],
+        "favourite_artist": account[2],
+        "favourite_genre": account[3],
+    }
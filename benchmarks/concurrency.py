@@ -0,0 +1,111 @@
+"""Runs several processes that edit account profiles at the same time, and then checks
+that none of their updates were lost. One of the processes also compacts the journal
+every so often, so that edits race against compaction too.
+
+Usage: python benchmarks/concurrency.py [processes] [edits per process]"""
+from multiprocessing import Process
+from pathlib import Path
+import tempfile
+import time
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from accounts import AccountStore
+from library import GENRES
+
+ACCOUNTS_PER_PROCESS = 10
+COMPACT_EVERY = 50
+
+
+"""Works out what an edit changes: each process owns its own accounts, and alternates
+between editing their favourite artist and favourite genre"""
+def planned_edit(process_number, edit):
+    name = f"User {process_number}-{edit % ACCOUNTS_PER_PROCESS}"
+    if edit % 2 == 0:
+        # Commas and quotes check that values survive being journaled and compacted
+        return name, 2, f'Artist {edit}, "The" Band'
+    return name, 3, GENRES[edit % len(GENRES)]
+
+
+def edit_profiles(path, process_number, edit_count):
+    store = AccountStore(path)
+    for edit in range(edit_count):
+        store.update(*planned_edit(process_number, edit))
+        if process_number == 0 and edit % COMPACT_EVERY == COMPACT_EVERY - 1:
+            store.compact()
+
+
+"""Works out what every account should look like once all the edits have been made"""
+def expected_accounts(process_count, edit_count):
+    expected = {}
+    for process_number in range(process_count):
+        for number in range(ACCOUNTS_PER_PROCESS):
+            name = f"User {process_number}-{number}"
+            expected[name] = [name, "2000-01-01", "Nobody", "pop"]
+        for edit in range(edit_count):
+            name, column, value = planned_edit(process_number, edit)
+            expected[name][column] = value
+    return expected
+
+
+def main():
+    process_count = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    edit_count = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = str(Path(directory) / "accounts.csv")
+        expected = expected_accounts(process_count, edit_count)
+        with open(path, "w") as accounts_csv:
+            for name in expected:
+                accounts_csv.write(f"{name},2000-01-01,Nobody,pop\n")
+
+        processes = [
+            Process(target=edit_profiles, args=(path, number, edit_count))
+            for number in range(process_count)
+        ]
+        start_time = time.perf_counter()
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start_time
+
+        failed = [process for process in processes if process.exitcode != 0]
+        if failed:
+            print(f"{len(failed)} processes crashed!")
+            sys.exit(1)
+
+        store = AccountStore(path)
+        journal_entries = store.refresh().journal_entries
+        store.compact()
+        # Read the compacted file back with a new store, through its index and by iterating
+        store = AccountStore(path)
+        accounts = {columns[0]: columns for columns in store}
+        for name in expected:
+            if store.get_row(name) != accounts.get(name):
+                print(f"Looking up {name} gave {store.get_row(name)}, not {accounts.get(name)}")
+                sys.exit(1)
+
+        # Since each account only has one writer, its final state is known exactly, and
+        # any difference means that a concurrent write clobbered an update
+        problems = 0
+        for name, columns in expected.items():
+            if accounts.get(name) != columns:
+                problems += 1
+                print(f"Lost update: {name} is {accounts.get(name)}, expected {columns}")
+        if len(accounts) != len(expected):
+            problems += 1
+            print(f"Expected {len(expected)} accounts, found {len(accounts)}")
+
+        total_edits = process_count * edit_count
+        print(
+            f"{process_count} processes made {total_edits} edits in {elapsed:.2f}s "
+            f"({total_edits / elapsed:.0f} edits/s), {journal_entries} left in the journal"
+        )
+        if problems:
+            sys.exit(1)
+        print("No updates were lost")
+
+
+if __name__ == "__main__":
+    main()
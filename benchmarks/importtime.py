@@ -0,0 +1,115 @@
+"""Measures how long each OCRtunes entry point takes to start, using python -X importtime,
+and checks it against a time budget. The slowest imports are listed, so that it's easy
+to see what to make lazy when a budget is exceeded.
+
+It also checks that the modules can be imported without side effects: importing them
+mustn't print anything or create any files.
+
+Usage: python benchmarks/importtime.py [--runs 5] [--top 8]"""
+from pathlib import Path
+import subprocess
+import argparse
+import tempfile
+import sys
+import os
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+# Each entry point, the Python arguments that start it, and its import time budget in ms.
+# The budgets cover every import (including Python's own start-up imports) and leave
+# room for slower machines.
+ENTRY_POINTS = [
+    ("import ocrtunes", ["-c", "import ocrtunes"], 60),
+    ("import menu", ["-c", "import menu"], 60),
+    ("import script", ["-c", "import script"], 60),
+    ("main.py --help", [str(ROOT_DIR / "main.py"), "--help"], 60),
+]
+SIDE_EFFECT_FREE = ["ocrtunes", "library", "accounts", "playlists", "jobs", "menu", "script"]
+
+
+def python_env():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = str(ROOT_DIR)
+    # Time the imports with their bytecode cached, like a normal run would be
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    return env
+
+
+def parse_importtime(stderr):
+    """Returns [(cumulative microseconds, depth, module)] from -X importtime's output"""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((int(cumulative), depth, name.strip()))
+    return imports
+
+
+def measure(arguments, directory):
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", *arguments],
+        cwd=directory,
+        env=python_env(),
+        capture_output=True,
+        text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr)
+    imports = parse_importtime(completed.stderr)
+    # The top-level imports' cumulative times add up to the total import time
+    total = sum(cumulative for cumulative, depth, _ in imports if depth == 0)
+    return total, imports
+
+
+def check_side_effects(directory):
+    modules = ", ".join(SIDE_EFFECT_FREE)
+    completed = subprocess.run(
+        [sys.executable, "-c", f"import {modules}"],
+        cwd=directory,
+        env=python_env(),
+        capture_output=True,
+        text=True,
+    )
+    created = os.listdir(directory)
+    problems = []
+    if completed.returncode != 0:
+        problems.append(f"importing failed:\n{completed.stderr}")
+    if completed.stdout:
+        problems.append(f"importing printed {completed.stdout!r}")
+    if created:
+        problems.append(f"importing created {', '.join(created)}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check OCRtunes' start-up time")
+    parser.add_argument("--runs", type=int, default=5, help="Runs per entry point (the best is used)")
+    parser.add_argument("--top", type=int, default=8, help="How many of the slowest imports to list")
+    arguments = parser.parse_args()
+
+    over_budget = False
+    with tempfile.TemporaryDirectory() as directory:
+        problems = check_side_effects(directory)
+        for problem in problems:
+            print(f"Side effect: {problem}")
+
+        for name, python_arguments, budget in ENTRY_POINTS:
+            # The first run caches the bytecode, so it isn't counted
+            measure(python_arguments, directory)
+            runs = [measure(python_arguments, directory) for _ in range(arguments.runs)]
+            total, imports = min(runs, key=lambda run: run[0])
+            status = "ok" if total / 1000 <= budget else "OVER BUDGET"
+            over_budget = over_budget or status != "ok"
+            print(f"{name:<16} {total / 1000:7.1f} ms (budget {budget} ms) {status}")
+            slowest = sorted(imports, reverse=True)[: arguments.top]
+            for cumulative, depth, module in slowest:
+                print(f"    {cumulative / 1000:7.1f} ms  {module}")
+
+    if problems or over_budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
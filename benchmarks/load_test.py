@@ -0,0 +1,105 @@
+"""Sends lots of concurrent requests to a running OCRtunes HTTP server (see server.py) and
+reports the throughput and latency. Each client keeps its connection open and sends a
+mix of library, search, account and playlist requests.
+
+Usage: python benchmarks/load_test.py [--clients 1000] [--requests 20] [--port 8080]"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+REQUEST_MIX = [
+    ("GET", "/songs?sort=title&limit=20", None),
+    ("GET", "/songs?sort=length&offset=10&limit=20", None),
+    ("GET", "/songs/search?q=love", None),
+    ("GET", "/songs/1", None),
+    ("GET", "/accounts/{user}", None),
+    ("POST", "/playlists", {"name": "{user}", "minutes": 30}),
+    ("GET", "/artists/Adele/export?format=jsonl", None),
+]
+
+
+def build_request(method, path, body, host, user):
+    path = path.replace("{user}", user)
+    payload = b""
+    if body is not None:
+        body = {
+            key: value.replace("{user}", user) if isinstance(value, str) else value
+            for key, value in body.items()
+        }
+        payload = json.dumps(body).encode()
+    head = (
+        f"{method} {path} HTTP/1.1\r\n"
+        f"Host: {host}\r\n"
+        f"Content-Length: {len(payload)}\r\n\r\n"
+    )
+    return head.encode() + payload
+
+
+async def read_response(reader):
+    status_line = await reader.readline()
+    status = int(status_line.split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def run_client(host, port, request_count, user, latencies, statuses):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for _ in range(request_count):
+            request = build_request(*random.choice(REQUEST_MIX), host, user)
+            start_time = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status = await read_response(reader)
+            latencies.append(time.perf_counter() - start_time)
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+async def main(arguments):
+    latencies = []
+    statuses = {}
+    start_time = time.perf_counter()
+    clients = [
+        run_client(
+            arguments.host, arguments.port, arguments.requests, arguments.user, latencies, statuses
+        )
+        for _ in range(arguments.clients)
+    ]
+    results = await asyncio.gather(*clients, return_exceptions=True)
+    elapsed = time.perf_counter() - start_time
+
+    failures = [result for result in results if isinstance(result, Exception)]
+    latencies.sort()
+    if not latencies:
+        print(f"No requests succeeded! First error: {failures[0]!r}")
+        return
+
+    def percentile(fraction):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000
+
+    print(f"Clients:     {arguments.clients} ({len(failures)} failed to finish)")
+    print(f"Requests:    {len(latencies)} in {elapsed:.2f}s ({len(latencies) / elapsed:.0f} requests/s)")
+    print(f"Latency:     p50 {percentile(0.5):.1f} ms, p99 {percentile(0.99):.1f} ms, max {latencies[-1] * 1000:.1f} ms")
+    print(f"Statuses:    {dict(sorted(statuses.items()))}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the OCRtunes HTTP server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=20, help="Requests per client")
+    parser.add_argument("--user", default="Mish", help="The account to use for requests")
+    asyncio.run(main(parser.parse_args()))
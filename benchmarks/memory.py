@@ -0,0 +1,62 @@
+"""Compares the memory used by the columnar SongLibrary with the list of dicts that
+get_library() used to build.
+
+Usage: python benchmarks/memory.py [number of songs]"""
+from pathlib import Path
+import tempfile
+import tracemalloc
+import csv
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from library import SongLibrary
+from synthetic import write_library
+
+
+def load_dicts(path):
+    songs = []
+    with open(path, "r") as library_csv:
+        for song in csv.reader(library_csv):
+            songs.append(
+                {
+                    "id": int(song[0]),
+                    "artist": song[1],
+                    "title": song[2],
+                    "length": int(song[3]),
+                    "genre": song[4],
+                }
+            )
+    return songs
+
+
+def load_columns(path):
+    return SongLibrary(path).refresh()
+
+
+def measure(loader, path):
+    tracemalloc.start()
+    result = loader(path)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current, peak
+
+
+def main():
+    song_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "library.csv"
+        write_library(path, song_count)
+
+        print(f"Songs: {song_count}")
+        for name, loader in [("list of dicts", load_dicts), ("columnar", load_columns)]:
+            current, peak = measure(loader, path)
+            per_song = current / song_count
+            print(
+                f"{name:>14}: {current / 2**20:8.1f} MiB retained "
+                f"({per_song:6.1f} bytes/song), {peak / 2**20:8.1f} MiB peak"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Compares running the library scans in shards.py in this process with running them on
+a pool of worker processes, for libraries of different sizes, to find the crossover
+point where the pool starts to pay off. That's what OCRTUNES_SCAN_THRESHOLD should be
+set to (see PARALLEL_SCAN_THRESHOLD in shards.py).
+
+The scans are filtering a set of excluded song IDs out of every song that's up to 5
+minutes long (what get_short_songs() does), and adding up every genre's songs and
+run time. Each time is the best of --repeats runs, after the pool has been started.
+
+Usage: python benchmarks/parallel_scan.py [--sizes 10000,100000,1000000] [--workers 2,4]
+                                   [--exclude 1000] [--repeats 5]"""
+from pathlib import Path
+import argparse
+import tempfile
+import random
+import time
+import sys
+import os
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARK_DIR.parent))
+sys.path.insert(0, str(BENCHMARK_DIR))
+from synthetic import write_library
+from library import SongLibrary
+from shards import LibraryShards, scan_threshold
+
+MAX_LENGTH = 5 * 60
+
+
+def best_time(function, repeats):
+    best = None
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def time_scans(library_shards, exclude, repeats):
+    # The first run starts the pool, so it isn't counted
+    library_shards.rows_in_range(0, MAX_LENGTH, exclude=exclude)
+    library_shards.totals("genre")
+    return (
+        best_time(lambda: library_shards.rows_in_range(0, MAX_LENGTH, exclude=exclude), repeats),
+        best_time(lambda: library_shards.totals("genre"), repeats),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parallel library scans")
+    parser.add_argument("--sizes", default="10000,100000,1000000",
+                        help="Comma-separated library sizes (numbers of songs)")
+    parser.add_argument("--workers", default=",".join(map(str, sorted({2, os.cpu_count() or 1}))),
+                        help="Comma-separated numbers of worker processes to try")
+    parser.add_argument("--exclude", type=int, default=1000, help="How many song IDs to exclude")
+    parser.add_argument("--repeats", type=int, default=5)
+    arguments = parser.parse_args()
+    sizes = [int(size.replace("_", "")) for size in arguments.sizes.split(",")]
+    worker_counts = [int(workers) for workers in arguments.workers.split(",")]
+
+    print(f"{os.cpu_count()} CPUs, the scan threshold is currently {scan_threshold()} rows")
+    print(f"{'Songs':>9}  {'Workers':>7}  {'Filter ms':>9}  {'Totals ms':>9}  Speed-up")
+    crossovers = {}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "library.csv"
+            write_library(path, size)
+            library = SongLibrary(path).refresh()
+            rng = random.Random(size)
+            exclude = {rng.randint(1, size) for _ in range(arguments.exclude)}
+
+            in_process = time_scans(LibraryShards(library, workers=1), exclude, arguments.repeats)
+            print(
+                f"{size:>9}  {'-':>7}  {in_process[0] * 1000:9.2f}  {in_process[1] * 1000:9.2f}"
+            )
+            for workers in worker_counts:
+                # A threshold of 0 makes every scan go to the pool
+                library_shards = LibraryShards(library, workers, threshold=0)
+                try:
+                    parallel = time_scans(library_shards, exclude, arguments.repeats)
+                finally:
+                    library_shards.close()
+                speed_ups = [before / after for before, after in zip(in_process, parallel)]
+                print(
+                    f"{size:>9}  {workers:>7}  {parallel[0] * 1000:9.2f}  {parallel[1] * 1000:9.2f}"
+                    f"  {speed_ups[0]:.2f}x / {speed_ups[1]:.2f}x"
+                )
+                if min(speed_ups) > 1:
+                    crossovers.setdefault(workers, size)
+
+    for workers in worker_counts:
+        if workers in crossovers:
+            print(f"With {workers} workers, the pool was faster from {crossovers[workers]} songs")
+        else:
+            print(f"With {workers} workers, the pool wasn't faster at any of these sizes")
+    # The pool has as many workers as there are CPUs unless it's told otherwise
+    workers = os.cpu_count() or 1
+    if workers in crossovers:
+        print(f"Suggested setting: OCRTUNES_SCAN_THRESHOLD={crossovers[workers]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""Times the main library and account functions against synthetic data files of
+different sizes, and writes the results as JSON lines so that runs can be compared.
+
+Each benchmark runs in its own Python process, so that caches from one benchmark don't
+speed up another and the peak memory that's reported belongs to that benchmark alone.
+Generated data files are kept in --data and reused by later runs.
+
+Usage: python benchmarks/run.py [--sizes 1000,10000,100000] [--only get_account,...]
+                                [--data benchmarks/data] [--results results.jsonl]"""
+from datetime import datetime, timezone
+from pathlib import Path
+import subprocess
+import argparse
+import platform
+import resource
+import tempfile
+import random
+import shutil
+import json
+import time
+import sys
+import os
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARK_DIR.parent))
+sys.path.insert(0, str(BENCHMARK_DIR))
+from synthetic import write_library, write_accounts
+from library import GENRES
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+# There's one account for every ACCOUNT_RATIO songs, with at least MIN_ACCOUNTS of them
+ACCOUNT_RATIO = 10
+MIN_ACCOUNTS = 100
+# Queries that touch every song are repeated fewer times on bigger libraries
+SCAN_BUDGET = 2_000_000
+PLAYLIST_MINUTES = 30
+
+
+def scan_repeats(size, most=200):
+    return max(3, min(most, SCAN_BUDGET // size))
+
+
+def prepare_data(data_dir, size, seed):
+    """Generates the library and accounts for this size, unless they're already there"""
+    size_dir = data_dir / str(size)
+    library_path = size_dir / "library.csv"
+    accounts_path = size_dir / "accounts.csv"
+    if not (library_path.exists() and accounts_path.exists()):
+        size_dir.mkdir(parents=True, exist_ok=True)
+        print(f"Generating {size} songs in {size_dir}", file=sys.stderr)
+        artists = write_library(library_path, size, seed)
+        account_count = max(MIN_ACCOUNTS, size // ACCOUNT_RATIO)
+        write_accounts(accounts_path, account_count, artists, seed)
+    return size_dir
+
+
+def account_names():
+    import ocrtunes
+
+    return [account["name"] for account in ocrtunes.iter_accounts()]
+
+
+# Each benchmark is given the size and a seeded RNG, and returns (operations, seconds)
+
+
+def bench_get_library_cold(size, rng):
+    import ocrtunes
+
+    snapshot = Path(ocrtunes.catalogue.snapshot_filename)
+    if snapshot.exists():
+        snapshot.unlink()
+    start_time = time.perf_counter()
+    ocrtunes.get_library()
+    return 1, time.perf_counter() - start_time
+
+
+def bench_get_library_snapshot(size, rng):
+    import ocrtunes
+
+    if not Path(ocrtunes.catalogue.snapshot_filename).exists():
+        ocrtunes.SongLibrary(ocrtunes.catalogue.filename).refresh()
+    start_time = time.perf_counter()
+    ocrtunes.get_library()
+    return 1, time.perf_counter() - start_time
+
+
+def bench_get_library_warm(size, rng):
+    import ocrtunes
+
+    ocrtunes.get_library()
+    repeats = scan_repeats(size, most=50)
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        ocrtunes.get_library()
+    return repeats, time.perf_counter() - start_time
+
+
+def bench_get_short_songs(size, rng):
+    import ocrtunes
+
+    ocrtunes.catalogue.refresh()
+    repeats = scan_repeats(size)
+    queries = [
+        (rng.randint(60, 300), {rng.randint(1, size) for _ in range(20)}) for _ in range(repeats)
+    ]
+    start_time = time.perf_counter()
+    for max_length, exclude in queries:
+        ocrtunes.get_short_songs(max_length, exclude)
+    return repeats, time.perf_counter() - start_time
+
+
+def bench_generate_playlist(size, rng):
+    import ocrtunes
+
+    ocrtunes.catalogue.refresh()
+    names = account_names()
+    chosen = [ocrtunes.get_account(rng.choice(names)) for _ in range(200)]
+    start_time = time.perf_counter()
+    for account in chosen:
+        ocrtunes.build_playlist(account, PLAYLIST_MINUTES * 60, rng=rng)
+    return len(chosen), time.perf_counter() - start_time
+
+
+def bench_get_account(size, rng):
+    import ocrtunes
+
+    names = account_names()
+    lookups = [rng.choice(names) for _ in range(5_000)]
+    start_time = time.perf_counter()
+    for name in lookups:
+        ocrtunes.get_account(name)
+    return len(lookups), time.perf_counter() - start_time
+
+
+def bench_update_user(size, rng):
+    import ocrtunes
+
+    names = account_names()
+    updates = [(rng.choice(names), rng.choice(GENRES)) for _ in range(1_000)]
+    start_time = time.perf_counter()
+    for name, genre in updates:
+        ocrtunes.state["user"] = {"name": name}
+        ocrtunes.update_user(3, genre)
+    return len(updates), time.perf_counter() - start_time
+
+
+BENCHMARKS = {
+    "get_library_cold": bench_get_library_cold,
+    "get_library_snapshot": bench_get_library_snapshot,
+    "get_library_warm": bench_get_library_warm,
+    "get_short_songs": bench_get_short_songs,
+    "generate_playlist": bench_generate_playlist,
+    "get_account": bench_get_account,
+    "update_user": bench_update_user,
+}
+# These change the data files, so they're run against a copy of them
+WRITES_ACCOUNTS = {"update_user"}
+
+
+def run_case(name, size, seed):
+    """Runs one benchmark in this process, with the data files in the working directory"""
+    operations, seconds = BENCHMARKS[name](size, random.Random(seed))
+    result = {
+        "benchmark": name,
+        "size": size,
+        "operations": operations,
+        "seconds": round(seconds, 6),
+        "throughput": round(operations / seconds, 3) if seconds else None,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "python": platform.python_version(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+    print(json.dumps(result))
+
+
+def spawn_case(name, size, seed, size_dir):
+    command = [sys.executable, str(Path(__file__).resolve()), "--case", name]
+    command += ["--size", str(size), "--seed", str(seed)]
+    with tempfile.TemporaryDirectory() as scratch:
+        work_dir = size_dir
+        if name in WRITES_ACCOUNTS:
+            work_dir = Path(scratch)
+            shutil.copy(size_dir / "accounts.csv", work_dir)
+            os.symlink(size_dir.resolve() / "library.csv", work_dir / "library.csv")
+        completed = subprocess.run(command, cwd=work_dir, capture_output=True, text=True)
+    if completed.returncode != 0:
+        print(f"{name} at size {size} failed:\n{completed.stderr}", file=sys.stderr)
+        return None
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark OCRtunes on synthetic data")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="Comma-separated library sizes (numbers of songs)")
+    parser.add_argument("--only", help="Comma-separated benchmarks to run (default: all)")
+    parser.add_argument("--data", default=str(BENCHMARK_DIR / "data"),
+                        help="Where to keep the generated data files")
+    parser.add_argument("--results", help="A JSON lines file to append the results to")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--case", choices=BENCHMARKS, help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.case:
+        run_case(arguments.case, arguments.size, arguments.seed)
+        return
+
+    names = arguments.only.split(",") if arguments.only else list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name!r} (choose from {', '.join(BENCHMARKS)})")
+    sizes = [int(size.replace("_", "")) for size in arguments.sizes.split(",")]
+
+    results_file = open(arguments.results, "a") if arguments.results else None
+    try:
+        for size in sizes:
+            size_dir = prepare_data(Path(arguments.data), size, arguments.seed)
+            for name in names:
+                result = spawn_case(name, size, arguments.seed, size_dir)
+                if result is None:
+                    continue
+                print(json.dumps(result), flush=True)
+                if results_file:
+                    results_file.write(json.dumps(result) + "\n")
+                    results_file.flush()
+    finally:
+        if results_file:
+            results_file.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Runs the interactive menu for a very long scripted session, to check that the stack
+depth and memory use stay the same however many actions a session goes through.
+
+The script logs in and out, searches, generates playlists and edits interests, with some
+invalid input mixed in so that the input validators have to ask again. Input is fed in
+by replacing menu.input, and the menu's output is thrown away.
+
+Usage: python benchmarks/soak.py [--actions 1000000] [--songs 1000] [--max-growth 16]"""
+from pathlib import Path
+import argparse
+import resource
+import tempfile
+import time
+import sys
+import os
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARK_DIR.parent))
+sys.path.insert(0, str(BENCHMARK_DIR))
+from synthetic import write_library, write_accounts
+
+# Each action is a list of (start of the prompt that should be shown, input to give)
+LOGGED_OUT_ACTIONS = [
+    [
+        ("Make a selection", "abc"),
+        ("Make a selection", "99"),
+        ("Make a selection", "2"),
+        ("Enter your name", "Nobody At All"),
+        ("Enter your name", "User 1"),
+    ],
+]
+LOGGED_IN_ACTIONS = [
+    [("Make a selection", "4"), ("Search for a song", "love")],
+    [("Make a selection", "4"), ("Search for a song", "nothing matches this")],
+    [
+        ("Make a selection", "6"),
+        ("Maximum run time", "soon"),
+        ("Maximum run time", "5:30"),
+        ("Press enter", ""),
+        ("Save this playlist", "n"),
+    ],
+    [
+        ("Make a selection", "7"),
+        ("Maximum run time", "8"),
+        ("Press enter", ""),
+        ("Save this playlist", ""),
+    ],
+    [("Make a selection", "8")],
+    [
+        ("Make a selection", "2"),
+        ("Make a selection", "2"),
+        ("Enter your new favourite genre", "jazz"),
+        ("Enter your new favourite genre", "rock"),
+    ],
+    [("Make a selection", "1"), ("Press enter", "")],
+]
+SCRIPT = LOGGED_OUT_ACTIONS + LOGGED_IN_ACTIONS
+REPORT_EVERY = 100_000
+
+
+class SoakFinished(Exception):
+    pass
+
+
+def current_rss_kib():
+    """The resident set size right now (falls back to the peak where /proc isn't there)"""
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def stack_depth():
+    depth = 0
+    frame = sys._getframe()
+    while frame:
+        depth += 1
+        frame = frame.f_back
+    return depth
+
+
+class ScriptedInput:
+    """Stands in for input(), giving the answers from SCRIPT over and over again"""
+
+    def __init__(self, action_count, report):
+        self.action_count = action_count
+        self.report = report
+        self.actions_done = 0
+        self.step = 0
+        self.action = 0
+        self.max_depth = 0
+
+    def __call__(self, prompt=""):
+        steps = SCRIPT[self.action]
+        if self.step == len(steps):
+            self.finish_action()
+            steps = SCRIPT[self.action]
+
+        expected, answer = steps[self.step]
+        if not prompt.startswith(expected):
+            raise RuntimeError(
+                f"Action {self.actions_done}: expected a prompt starting with {expected!r}, "
+                f"but got {prompt!r}"
+            )
+        self.step += 1
+        return answer
+
+    def finish_action(self):
+        self.actions_done += 1
+        self.action = (self.action + 1) % len(SCRIPT)
+        self.step = 0
+        if self.actions_done % 1000 == 0:
+            self.max_depth = max(self.max_depth, stack_depth())
+        if self.actions_done % REPORT_EVERY == 0:
+            self.report(self)
+        if self.actions_done >= self.action_count:
+            raise SoakFinished()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak test the OCRtunes menu")
+    parser.add_argument("--actions", type=int, default=1_000_000)
+    parser.add_argument("--songs", type=int, default=1_000)
+    parser.add_argument(
+        "--max-growth", type=float, default=16, help="How many MiB RSS may grow by (after warm-up)"
+    )
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        artists = write_library(Path(directory) / "library.csv", arguments.songs)
+        write_accounts(Path(directory) / "accounts.csv", 100, artists)
+        os.chdir(directory)
+        import menu
+
+        real_stdout = sys.stdout
+        samples = []
+        start_time = time.perf_counter()
+
+        def report(scripted):
+            rss = current_rss_kib()
+            samples.append(rss)
+            elapsed = time.perf_counter() - start_time
+            print(
+                f"{scripted.actions_done:>9} actions  {elapsed:8.1f}s  "
+                f"{scripted.actions_done / elapsed:8.0f} actions/s  RSS {rss / 1024:7.1f} MiB  "
+                f"max stack depth {scripted.max_depth}",
+                file=real_stdout,
+                flush=True,
+            )
+
+        scripted = ScriptedInput(arguments.actions, report)
+        menu.input = scripted
+        sys.stdout = open(os.devnull, "w")
+        try:
+            menu.run_menu()
+        except SoakFinished:
+            pass
+        finally:
+            sys.stdout.close()
+            sys.stdout = real_stdout
+            os.chdir(BENCHMARK_DIR)
+
+    if scripted.actions_done % REPORT_EVERY:
+        report(scripted)
+    # The first sample includes the caches and indexes that are built up at the start
+    growth = (samples[-1] - samples[0]) / 1024
+    print(f"RSS grew by {growth:.1f} MiB after the first sample")
+    if growth > arguments.max_growth:
+        print(f"That's more than the allowed {arguments.max_growth} MiB!")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
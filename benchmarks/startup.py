@@ -0,0 +1,39 @@
+"""Compares how long it takes to load the song library by parsing library.csv with how
+long it takes to load the binary snapshot that's saved next to it.
+
+Usage: python benchmarks/startup.py [number of songs]"""
+from pathlib import Path
+import tempfile
+import time
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from library import SongLibrary
+from synthetic import write_library
+
+
+def time_load(path):
+    start_time = time.perf_counter()
+    library = SongLibrary(path).refresh()
+    return time.perf_counter() - start_time, len(library)
+
+
+def main():
+    song_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    with tempfile.TemporaryDirectory() as directory:
+        path = str(Path(directory) / "library.csv")
+        write_library(path, song_count)
+
+        # The first load has no snapshot, so it parses the CSV (and then saves one)
+        parse_time, loaded_count = time_load(path)
+        snapshot_time, _ = time_load(path)
+        snapshot_size = Path(path + ".snapshot").stat().st_size
+
+        print(f"Songs: {loaded_count}")
+        print(f"Parsing CSV:      {parse_time * 1000:9.1f} ms (including saving the snapshot)")
+        print(f"Loading snapshot: {snapshot_time * 1000:9.1f} ms ({snapshot_size / 2**20:.1f} MiB)")
+        print(f"Speed-up:         {parse_time / snapshot_time:9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
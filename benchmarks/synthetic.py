@@ -0,0 +1,107 @@
+"""Generates synthetic library.csv and accounts.csv files for benchmarking, with roughly
+realistic distributions: a few artists have lots of songs while most have a handful
+(a Zipf distribution), some genres are more common than others, song lengths cluster
+around three and a half minutes, and titles are made of common words.
+
+Usage: python benchmarks/synthetic.py --songs 100000 --accounts 10000 --out data/"""
+from itertools import accumulate
+from pathlib import Path
+import argparse
+import random
+import csv
+
+GENRE_WEIGHTS = {"pop": 40, "rock": 25, "hip hop": 20, "rap": 15}
+TITLE_WORDS = (
+    "love heart night baby dance fire light dream time world girl boy summer rain "
+    "money party home road sky gold blue wild young forever tonight never always "
+    "feel know want need stay run fall rise shine break lose find hold call"
+).split()
+NAME_PARTS = (
+    "Adele Drake Sia Ed Taylor Bruno Kanye Rihanna Lil Big Young DJ MC The Black "
+    "White Royal Electric Velvet Golden Silver Midnight Neon Wild Lost Stone"
+).split()
+ARTIST_SKEW = 1.1
+SONGS_PER_ARTIST = 10
+CHUNK_SIZE = 10_000
+
+
+def artist_names(count, rng):
+    names = []
+    for number in range(count):
+        words = rng.sample(NAME_PARTS, rng.randint(1, 2))
+        names.append(f"{' '.join(words)} {number}")
+    return names
+
+
+"""Cumulative weights for picking artists, where the artist at rank r is 1 / r^skew
+times as likely to be picked as the most popular one"""
+def zipf_weights(count, skew=ARTIST_SKEW):
+    return list(accumulate(1 / rank ** skew for rank in range(1, count + 1)))
+
+
+def write_library(path, song_count, seed=0):
+    """Writes a library with song_count songs, and returns the list of artist names"""
+    rng = random.Random(seed)
+    artists = artist_names(max(1, song_count // SONGS_PER_ARTIST), rng)
+    artist_weights = zipf_weights(len(artists))
+    genres = list(GENRE_WEIGHTS)
+    genre_weights = list(accumulate(GENRE_WEIGHTS.values()))
+
+    with open(path, "w", newline="") as library_csv:
+        writer = csv.writer(library_csv)
+        for chunk_start in range(1, song_count + 1, CHUNK_SIZE):
+            chunk_size = min(CHUNK_SIZE, song_count + 1 - chunk_start)
+            chunk_artists = rng.choices(artists, cum_weights=artist_weights, k=chunk_size)
+            chunk_genres = rng.choices(genres, cum_weights=genre_weights, k=chunk_size)
+            writer.writerows(
+                [
+                    chunk_start + offset,
+                    chunk_artists[offset],
+                    " ".join(rng.sample(TITLE_WORDS, rng.randint(1, 4))).title(),
+                    min(900, max(60, int(rng.gauss(210, 45)))),
+                    chunk_genres[offset],
+                ]
+                for offset in range(chunk_size)
+            )
+    return artists
+
+
+def write_accounts(path, account_count, artists, seed=0):
+    """Writes account_count accounts, whose favourite artists follow the same
+    distribution as the library's. Returns the list of account names."""
+    rng = random.Random(seed + 1)
+    artist_weights = zipf_weights(len(artists))
+    genres = list(GENRE_WEIGHTS)
+    genre_weights = list(accumulate(GENRE_WEIGHTS.values()))
+    names = []
+
+    with open(path, "w", newline="") as accounts_csv:
+        for chunk_start in range(0, account_count, CHUNK_SIZE):
+            chunk_size = min(CHUNK_SIZE, account_count - chunk_start)
+            favourite_artists = rng.choices(artists, cum_weights=artist_weights, k=chunk_size)
+            favourite_genres = rng.choices(genres, cum_weights=genre_weights, k=chunk_size)
+            rows = []
+            for offset in range(chunk_size):
+                name = f"User {chunk_start + offset}"
+                names.append(name)
+                birth_date = f"{rng.randint(1950, 2015)}-{rng.randint(1, 12):02}-{rng.randint(1, 28):02}"
+                rows.append(
+                    f"{name},{birth_date},{favourite_artists[offset]},{favourite_genres[offset]}\n"
+                )
+            accounts_csv.writelines(rows)
+    return names
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic OCRtunes data files")
+    parser.add_argument("--songs", type=int, default=100_000)
+    parser.add_argument("--accounts", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=".", help="Directory to write the files to")
+    arguments = parser.parse_args()
+
+    out_dir = Path(arguments.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    artists = write_library(out_dir / "library.csv", arguments.songs, arguments.seed)
+    write_accounts(out_dir / "accounts.csv", arguments.accounts, artists, arguments.seed)
+    print(f"Wrote {arguments.songs} songs and {arguments.accounts} accounts to {out_dir}")
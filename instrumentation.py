@@ -0,0 +1,166 @@
+"""Opt-in counters, latency histograms and profiling for OCRtunes (see Stats)"""
+from contextlib import contextmanager
+from functools import wraps
+import sys
+import time
+import os
+
+# How many lines of cProfile output to print for a profiled menu action
+PROFILE_LINES = 25
+
+
+class Stats:
+    """Opt-in counters and latency histograms for menu actions and for the functions that
+    read and write the data files. It's turned on by the --stats flag or the OCRTUNES_STATS
+    environment variable, and only costs an attribute check per call while it's off.
+
+    Each timer keeps a histogram of how long calls took, with one bucket per power of two
+    microseconds, so the percentiles it reports are upper bounds."""
+
+    def __init__(self, enabled=False, profile_action=None):
+        self.enabled = enabled
+        # The name of a menu option to run under cProfile (the first time it's picked)
+        self.profile_action = profile_action
+        # {name: {"calls", "rows", "total", "max", "buckets"}}
+        self.timers = {}
+        # {name: amount}, e.g. bytes written to a file
+        self.counters = {}
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record(self, name, seconds, rows=0):
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = {"calls": 0, "rows": 0, "total": 0.0, "max": 0.0, "buckets": {}}
+            self.timers[name] = timer
+        bucket = int(seconds * 1_000_000).bit_length()
+        timer["calls"] += 1
+        timer["rows"] += rows
+        timer["total"] += seconds
+        timer["max"] = max(timer["max"], seconds)
+        timer["buckets"][bucket] = timer["buckets"].get(bucket, 0) + 1
+
+    @contextmanager
+    def timer(self, name):
+        if not self.enabled:
+            yield
+            return
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start_time)
+
+    def timed(self, name, rows=None):
+        """Decorates a function so that its calls are timed. rows is an optional function
+        that works out how many rows a call read from what it returned."""
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                start_time = time.perf_counter()
+                result = function(*args, **kwargs)
+                self.record(name, time.perf_counter() - start_time, rows(result) if rows else 0)
+                return result
+            return wrapper
+        return decorator
+
+    def run_action(self, name, callback, *args):
+        """Runs a menu option's callback, timing it and profiling it if it was asked for"""
+        if not self.enabled and self.profile_action != name:
+            return callback(*args)
+        profiler = None
+        if self.profile_action == name:
+            import cProfile
+
+            profiler = cProfile.Profile()
+            # Only profile the first run, so that the results aren't an average
+            self.profile_action = None
+        start_time = time.perf_counter()
+        try:
+            if profiler:
+                return profiler.runcall(callback, *args)
+            return callback(*args)
+        finally:
+            if self.enabled:
+                self.record(f"menu: {name}", time.perf_counter() - start_time)
+            if profiler:
+                import pstats
+
+                print(f"\nProfile of {name!r}:", file=sys.stderr)
+                pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(
+                    PROFILE_LINES
+                )
+
+    def percentile(self, timer, fraction):
+        wanted = timer["calls"] * fraction
+        seen = 0
+        for bucket in sorted(timer["buckets"]):
+            seen += timer["buckets"][bucket]
+            if seen >= wanted:
+                return min(2**bucket / 1_000_000, timer["max"])
+        return timer["max"]
+
+    def report(self):
+        lines = [
+            f"{'Timer':<40} {'calls':>8} {'rows':>10} {'total ms':>10} "
+            f"{'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+        ]
+        for name, timer in sorted(self.timers.items()):
+            lines.append(
+                f"{name:<40} {timer['calls']:>8} {timer['rows']:>10} "
+                f"{timer['total'] * 1000:>10.2f} {timer['total'] / timer['calls'] * 1000:>9.3f} "
+                f"{self.percentile(timer, 0.5) * 1000:>9.3f} "
+                f"{self.percentile(timer, 0.99) * 1000:>9.3f} {timer['max'] * 1000:>9.3f}"
+            )
+        if self.counters:
+            lines.append("")
+            for name, amount in sorted(self.counters.items()):
+                lines.append(f"{name:<40} {amount:>8}")
+        return "\n".join(lines)
+
+    def dump(self):
+        if self.timers or self.counters:
+            print("\n" + self.report(), file=sys.stderr)
+
+
+class TimedStream:
+    """Wraps an output stream (i.e. the terminal) to count and time what's written to it"""
+
+    def __init__(self, stream, metrics):
+        self.stream = stream
+        self.metrics = metrics
+
+    def write(self, text):
+        start_time = time.perf_counter()
+        written = self.stream.write(text)
+        self.metrics.record("terminal output", time.perf_counter() - start_time)
+        self.metrics.count("bytes written: terminal", len(text.encode(errors="replace")))
+        return written
+
+    def flush(self):
+        with self.metrics.timer("terminal flush"):
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+metrics = Stats(
+    enabled=bool(os.environ.get("OCRTUNES_STATS")),
+    profile_action=os.environ.get("OCRTUNES_PROFILE") or None,
+)
+
+
+"""Turns on the stats (if they're wanted) and arranges for them to be printed on exit"""
+def start_stats(enabled, profile_action=None):
+    import atexit
+
+    metrics.enabled = metrics.enabled or enabled
+    metrics.profile_action = profile_action or metrics.profile_action
+    if metrics.enabled:
+        sys.stdout = TimedStream(sys.stdout, metrics)
+        atexit.register(metrics.dump)
@@ -0,0 +1,204 @@
+"""Batch jobs that are run from the command line (see python main.py --help)"""
+from pathlib import Path
+import re
+import time
+import random
+import os
+
+from library import EXPORT_BUFFER_SIZE, RejectReport, iter_library_rows, format_song, format_export
+from library import parse_seconds
+from ocrtunes import catalogue, accounts, iter_accounts, build_playlist
+from shards import LibraryShards
+
+# The characters that aren't allowed in the file names that batch jobs save to
+UNSAFE_FILENAME_PATTERN = re.compile(r"[^\w\- ]")
+
+
+"""Turns a user's name into something that's safe to use as a filename"""
+def safe_filename(name):
+    return UNSAFE_FILENAME_PATTERN.sub("_", name).strip() or "_"
+
+
+"""Turns name into a file name with the given extension that isn't in used yet, even if
+the name looks the same as an earlier one once it's been made safe to use as a file name
+(e.g. O'Brien and O_Brien). Clashes get a numbered suffix, which can't clash with a safe
+name because brackets aren't safe. used holds the file names taken so far, in lowercase,
+so that names that only differ by case don't clash on case-insensitive file systems
+either, and the new file name is added to it."""
+def unique_filename(name, extension, used):
+    safe_name = safe_filename(name)
+    filename = f"{safe_name}.{extension}"
+    number = 2
+    while filename.lower() in used:
+        filename = f"{safe_name} ({number}).{extension}"
+        number += 1
+    used.add(filename.lower())
+    return filename
+
+
+"""Generates a playlist for each (account, file name) in a batch, and saves each one to
+its file in out_dir. Returns the number of playlists made."""
+def write_playlists(batch, max_seconds, best_fit, seed, out_dir):
+    for account, filename in batch:
+        # Seeding from the user's name means re-running the batch gives the same playlists
+        rng = random.Random(f"{seed}:{account['name']}")
+        playlist = build_playlist(account, max_seconds, best_fit, rng)
+        lines = [format_song(catalogue.get(song_id)) + "\n" for song_id in playlist]
+        playlist_path = Path(out_dir) / filename
+        with playlist_path.open("w") as file:
+            file.writelines(lines)
+    return len(batch)
+
+
+"""Generates a playlist for every account in accounts.csv without any user interaction,
+using a pool of worker processes. The accounts are streamed in batches so that only a
+few batches are in memory at once."""
+def generate_all(minutes, out_dir, seed=0, workers=None, best_fit=False, batch_size=256):
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+    from itertools import islice
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    max_seconds = minutes * 60
+    # Load the library before the pool starts, so forked workers all share this copy
+    catalogue.refresh()
+
+    start_time = time.perf_counter()
+    playlist_count = 0
+    workers = workers or os.cpu_count() or 1
+    # The file names are picked here, in account order, so that they're the same however
+    # the accounts are split between the workers
+    used_filenames = set()
+    account_rows = (
+        (account, unique_filename(account["name"], "txt", used_filenames))
+        for account in iter_accounts()
+    )
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        max_pending = workers * 2
+        pending = set()
+        while True:
+            while len(pending) < max_pending:
+                batch = list(islice(account_rows, batch_size))
+                if not batch:
+                    break
+                pending.add(
+                    executor.submit(
+                        write_playlists, batch, max_seconds, best_fit, seed, out_dir
+                    )
+                )
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                playlist_count += future.result()
+
+    elapsed = time.perf_counter() - start_time
+    rate = playlist_count / elapsed if elapsed else 0
+    print(f"Generated {playlist_count} playlists in {elapsed:.2f}s ({rate:.1f} playlists/s)")
+    return playlist_count
+
+
+"""Indexes an existing accounts.csv file, so that it can be used with the account store"""
+def migrate_accounts():
+    accounts.build_index()
+    accounts.save_index()
+    print(f"Indexed {len(accounts.offsets)} accounts from {accounts.filename}")
+
+
+def compact_accounts():
+    entries = accounts.refresh().journal_entries
+    accounts.compact()
+    print(f"Folded {entries} journal entries into {accounts.filename}")
+
+
+"""Validates a library CSV file without loading it, and writes a report of bad rows"""
+def check_library(filename):
+    report = RejectReport(filename + ".rejects")
+    song_count = 0
+    try:
+        for _ in iter_library_rows(filename, report.reject):
+            song_count += 1
+    finally:
+        report.close()
+
+    print(f"{song_count} valid songs in {filename}")
+    if report.count:
+        print(f"{report.count} rows were rejected: see {report.filename}")
+
+
+"""Prints how many songs, and how much music, each genre or artist in the library has.
+Big libraries are added up by a pool of worker processes (see shards.py)."""
+def summarise_library(group="genre", workers=None):
+    catalogue.refresh()
+    start_time = time.perf_counter()
+    library_shards = LibraryShards(catalogue, workers)
+    try:
+        totals = library_shards.totals(group)
+    finally:
+        library_shards.close()
+    elapsed = time.perf_counter() - start_time
+
+    by_size = sorted(totals.items(), key=lambda item: (-item[1][0], item[0].lower()))
+    print(f"{'Songs':>8}  {'Run time':>10}  {group.capitalize()}")
+    for name, (song_count, seconds) in by_size:
+        print(f"{song_count:>8}  {parse_seconds(seconds):>10}  {name}")
+    print(f"{len(catalogue)} songs in {len(totals)} {group}s, added up in {elapsed:.2f}s")
+
+
+"""Exports one artist's songs, returning the file name to use and the file's contents"""
+def export_artist(code, format, filenames):
+    start, end = catalogue.artist_starts[code], catalogue.artist_starts[code + 1]
+    songs = catalogue.iter_songs(catalogue.artist_rows[start:end])
+    return filenames[code], format_export(songs, format)
+
+
+"""Gives every artist a different file name (see unique_filename()), in artist code order"""
+def artist_filenames(format):
+    used = set()
+    return [unique_filename(artist, format, used) for artist in catalogue.artist_names]
+
+
+"""Exports the songs of every artist in the library, each to their own file in the out
+directory, or all into one zip archive at out. The library is already grouped by artist,
+so each artist's file is formatted in one go and saved with a single buffered write,
+optionally spread across a pool of threads."""
+def export_all_artists(out, format="txt", archive=False, workers=None):
+    from concurrent.futures import ThreadPoolExecutor
+
+    start_time = time.perf_counter()
+    catalogue.refresh()
+    filenames = artist_filenames(format)
+    codes = range(len(catalogue.artist_names))
+    total_bytes = 0
+
+    if archive:
+        import zipfile
+
+        with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zip_file:
+            for code in codes:
+                filename, contents = export_artist(code, format, filenames)
+                zip_file.writestr(filename, contents)
+                total_bytes += len(contents)
+    else:
+        out_dir = Path(out)
+        out_dir.mkdir(parents=True, exist_ok=True)
+
+        def write_artist(code):
+            filename, contents = export_artist(code, format, filenames)
+            with open(out_dir / filename, "w", buffering=EXPORT_BUFFER_SIZE) as file:
+                file.write(contents)
+            return len(contents)
+
+        if workers == 1:
+            total_bytes = sum(map(write_artist, codes))
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                total_bytes = sum(executor.map(write_artist, codes))
+
+    elapsed = time.perf_counter() - start_time
+    rate = len(codes) / elapsed if elapsed else 0
+    print(
+        f"Exported {len(catalogue)} songs from {len(codes)} artists to {out} "
+        f"({total_bytes / 2**20:.1f} MiB) in {elapsed:.2f}s ({rate:.0f} artists/s)"
+    )
+    return len(codes)
@@ -0,0 +1,1033 @@
+"""The song library: reading and validating library.csv, the in-memory columns and
+indexes that it's loaded into, searching it, and formatting songs for display and export"""
+from bisect import bisect_left, bisect_right
+from itertools import repeat, chain
+from array import array
+import atexit
+import struct
+import sys
+import re
+import io
+import csv
+import heapq
+import os
+
+from instrumentation import metrics
+from storage import file_lock, file_digest
+
+GENRES = ["pop", "rock", "hip hop", "rap"]
+
+# The biggest song ID and length (in seconds) that fit in the library's columns. The
+# lengths are limited to what fits in a C long everywhere, which is 32 bits on Windows.
+MAX_SONG_ID = 2**63 - 1
+MAX_SONG_LENGTH = 2**31 - 1
+
+# The formats that songs can be exported in, and the buffer size used when writing them
+EXPORT_FORMATS = ["txt", "jsonl", "m3u"]
+EXPORT_BUFFER_SIZE = 1024 * 1024
+
+# Search settings: how many results to show, how much prefix and fuzzy (misspelt) word
+# matches count for compared to exact ones, how alike words have to be to count as a
+# fuzzy match, and how many prefix and fuzzy matches to try for each word
+SEARCH_RESULT_COUNT = 10
+PREFIX_WEIGHT = 0.8
+FUZZY_WEIGHT = 0.6
+FUZZY_THRESHOLD = 0.35
+MAX_PREFIX_EXPANSIONS = 50
+MAX_FUZZY_MATCHES = 5
+ARTIST_SUGGESTION_THRESHOLD = 0.15
+# How many posting lists with the same weight a search word can have before they're
+# sorted into one list
+MAX_POSTING_LISTS = 16
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+# The SongLibrary attribute holding each of the orders that the library can be sorted in
+SORT_ORDERS = {
+    "title": "title_order",
+    "artist": "artist_order",
+    "length": "length_order",
+    "genre": "genre_order",
+}
+
+# The binary snapshot of the parsed library that's kept next to library.csv. The header
+# holds the magic bytes, format version, byte order, and the CSV's modification time,
+# size, SHA-256 hash and rejected row count. Each section after it holds an array
+# typecode, item size and byte count, followed by the data.
+SNAPSHOT_MAGIC = b"OCRTSNAP"
+SNAPSHOT_VERSION = 2
+SNAPSHOT_HEADER = struct.Struct("<8sHcqq32sq")
+SNAPSHOT_SECTION = struct.Struct("<cBq")
+SNAPSHOT_ARRAYS = (
+    "ids",
+    "lengths",
+    "artist_codes",
+    "genre_codes",
+    "title_offsets",
+    "artist_rows",
+    "artist_starts",
+    "genre_rows",
+    "genre_starts",
+    "length_order",
+    "sorted_lengths",
+    "genre_length_rows",
+    "genre_sorted_lengths",
+    "title_order",
+    "artist_order",
+    "genre_order",
+)
+
+
+"""Checks that the sections read from a snapshot fit together: the columns with one item
+per song are all the same length, and the offsets and starts cover the titles and names"""
+def snapshot_sections_agree(sections):
+    if len(sections) != len(SNAPSHOT_ARRAYS) + 3:
+        return False
+    columns = dict(zip(SNAPSHOT_ARRAYS, sections))
+    title_store, artist_names, genre_names = sections[-3:]
+    if not all(isinstance(column, array) for column in columns.values()):
+        return False
+    if not all(isinstance(text, str) for text in (title_store, artist_names, genre_names)):
+        return False
+    song_count = len(columns["ids"])
+    for name, column in columns.items():
+        if name not in ("title_offsets", "artist_starts", "genre_starts"):
+            if len(column) != song_count:
+                return False
+    artist_count = len(artist_names.split("\0")) if artist_names else 0
+    genre_count = len(genre_names.split("\0")) if genre_names else 0
+    title_offsets = columns["title_offsets"]
+    return (
+        len(title_offsets) == song_count + 1
+        and title_offsets[-1] == len(title_store)
+        and len(columns["artist_starts"]) == artist_count + 1
+        and len(columns["genre_starts"]) == genre_count + 1
+    )
+
+
+"""Takes length of time, in seconds and converts it to a string in the format MM:SS"""
+def parse_seconds(seconds):
+    seconds = int(seconds)
+    minutes = seconds // 60
+    seconds = seconds % 60
+    return f"{minutes}:{seconds:02}"
+
+
+class RejectReport:
+    """Writes rows that failed validation to a CSV report. The file is only created if
+    something gets rejected, and an old report is removed if nothing does."""
+
+    def __init__(self, filename):
+        self.filename = os.fspath(filename)
+        self.file = None
+        self.writer = None
+        self.count = 0
+
+    def reject(self, line_number, row, reason):
+        if self.file is None:
+            self.file = open(self.filename, "w", newline="")
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(["line", "reason", "row"])
+        self.writer.writerow([line_number, reason, ",".join(row)])
+        self.count += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        elif os.path.exists(self.filename):
+            os.remove(self.filename)
+
+
+"""Converts text to a whole number from 0 to maximum. Returns None if it isn't one."""
+def parse_whole_number(text, maximum):
+    text = text.strip()
+    # isdigit() alone also accepts characters like "²", which int() can't convert
+    if not (text.isascii() and text.isdigit()):
+        return None
+    number = int(text)
+    return number if number <= maximum else None
+
+
+"""Checks one row of a library CSV file. Returns the reason it's invalid, or None if it's fine."""
+def validate_song_row(row, seen_ids):
+    if len(row) < 5:
+        return "does not have all the required fields"
+    id = parse_whole_number(row[0], MAX_SONG_ID)
+    if id is None:
+        return f"has an invalid ID: {row[0]!r}"
+    if id in seen_ids:
+        return f"has the same ID as an earlier song: {row[0]}"
+    if parse_whole_number(row[3], MAX_SONG_LENGTH) is None:
+        return f"has a length that isn't a whole number of seconds: {row[3]!r}"
+    if row[4] not in GENRES:
+        return f"has an unknown genre: {row[4]!r}"
+    return None
+
+
+"""Reads the songs from a library CSV file one row at a time, so memory use doesn't grow
+with the size of the file. Each row is validated, and invalid rows are passed to
+on_reject(line_number, row, reason) and skipped instead of stopping the whole import.
+Yields (id, artist, title, length, genre) tuples."""
+def iter_library_rows(filename, on_reject=None):
+    try:
+        library_csv = open(filename, "r", newline="")
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Could not access {filename}!")
+
+    # A set rather than a SongBitmap, because one huge ID would make a bitmap huge too
+    seen_ids = set()
+    with library_csv:
+        reader = csv.reader(library_csv)
+        for row in reader:
+            if not row:
+                continue
+            problem = validate_song_row(row, seen_ids)
+            if problem:
+                if on_reject:
+                    on_reject(reader.line_num, row, problem)
+                continue
+
+            id = int(row[0])
+            seen_ids.add(id)
+            yield id, row[1], row[2], int(row[3]), row[4]
+
+
+class Song:
+    """A lightweight view of one row in a SongLibrary. It supports the same
+    song["field"] lookups as a song dict, without storing a copy of the fields."""
+
+    __slots__ = ("library", "row")
+
+    FIELDS = ("id", "artist", "title", "length", "genre")
+
+    def __init__(self, library, row):
+        self.library = library
+        self.row = row
+
+    def __getitem__(self, field):
+        library = self.library
+        row = self.row
+        if field == "id":
+            return library.ids[row]
+        if field == "title":
+            return library.title(row)
+        if field == "artist":
+            return library.artist_names[library.artist_codes[row]]
+        if field == "length":
+            return library.lengths[row]
+        if field == "genre":
+            return library.genre_names[library.genre_codes[row]]
+        raise KeyError(field)
+
+    def keys(self):
+        return self.FIELDS
+
+    def __eq__(self, other):
+        if not isinstance(other, Song):
+            return NotImplemented
+        return self.library is other.library and self.row == other.row
+
+    def __hash__(self):
+        return hash((id(self.library), self.row))
+
+    def __repr__(self):
+        return f"Song({dict(self)!r})"
+
+
+class SongBitmap:
+    """A compact set of song IDs, stored as one bit per ID"""
+
+    __slots__ = ("bits", "count")
+
+    def __init__(self, ids=()):
+        self.bits = bytearray()
+        self.count = 0
+        for id in ids:
+            self.add(id)
+
+    def add(self, id):
+        byte, bit = id >> 3, 1 << (id & 7)
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(byte + 1 - len(self.bits)))
+        if not self.bits[byte] & bit:
+            self.bits[byte] |= bit
+            self.count += 1
+
+    def __contains__(self, id):
+        byte = id >> 3
+        return 0 <= byte < len(self.bits) and bool(self.bits[byte] & (1 << (id & 7)))
+
+    def __len__(self):
+        return self.count
+
+
+"""Groups row numbers by a column of small integer codes (e.g. artist codes).
+Returns (rows, starts), where the rows with code c are rows[starts[c]:starts[c + 1]]."""
+def group_rows(codes, code_count):
+    starts = array("l", [0]) * (code_count + 1)
+    for code in codes:
+        starts[code + 1] += 1
+    for code in range(code_count):
+        starts[code + 1] += starts[code]
+
+    rows = array("l", [0]) * len(codes)
+    positions = starts[:-1]
+    for row, code in enumerate(codes):
+        rows[positions[code]] = row
+        positions[code] += 1
+    return rows, starts
+
+
+"""Splits some text into lowercase words, for the search index"""
+def tokenize(text):
+    return WORD_PATTERN.findall(text.lower())
+
+
+"""The set of three-letter chunks in a word, padded so that the start and end count too"""
+def trigrams(word):
+    padded = f"  {word} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+"""Scores how alike two sets of trigrams are, from 0 (nothing shared) to 1 (identical)"""
+def similarity(shared, first_count, second_count):
+    return shared / (first_count + second_count - shared)
+
+
+"""Finds the entries in a trigram index that look most like a word. The index maps each
+trigram to a list of entry numbers, and entry_trigram_counts holds how many trigrams each
+entry has. Returns (similarity, entry) pairs, best first."""
+def fuzzy_matches(word, trigram_index, entry_trigram_counts, limit):
+    word_trigrams = trigrams(word)
+    shared_counts = {}
+    for trigram in word_trigrams:
+        for entry in trigram_index.get(trigram, ()):
+            shared_counts[entry] = shared_counts.get(entry, 0) + 1
+    scored = [
+        (similarity(shared, len(word_trigrams), entry_trigram_counts[entry]), entry)
+        for entry, shared in shared_counts.items()
+    ]
+    return heapq.nlargest(limit, scored)
+
+
+class SearchIndex:
+    """An inverted index of the words in every song's title and artist, which supports
+    ranked searches by whole words, word prefixes and misspelt words (by comparing the
+    trigrams of each word). It also suggests artists whose names look like some text."""
+
+    def __init__(self, library):
+        self.library = library
+
+        title_postings = {}
+        for row in range(len(library)):
+            for word in set(tokenize(library.title(row))):
+                title_postings.setdefault(word, array("l")).append(row)
+        # Artist words point at artist codes, which are expanded into rows when searching
+        artist_postings = {}
+        for code, name in enumerate(library.artist_names):
+            for word in set(tokenize(name)):
+                artist_postings.setdefault(word, array("l")).append(code)
+        self.title_postings = title_postings
+        self.artist_postings = artist_postings
+
+        # A sorted list of every word, for prefix searches
+        self.words = sorted(set(title_postings) | set(artist_postings))
+        self.word_trigram_index, self.word_trigram_counts = self.trigram_index(self.words)
+        self.artist_trigram_index, self.artist_trigram_counts = self.trigram_index(
+            name.lower() for name in library.artist_names
+        )
+
+    def trigram_index(self, entries):
+        index = {}
+        counts = []
+        for number, entry in enumerate(entries):
+            entry_trigrams = trigrams(entry)
+            counts.append(len(entry_trigrams))
+            for trigram in entry_trigrams:
+                index.setdefault(trigram, []).append(number)
+        return index, counts
+
+    def word_matches(self, token):
+        """Finds the indexed words that a search word could mean, with a weight for each"""
+        matches = {}
+        start = bisect_left(self.words, token)
+        for word in self.words[start : start + MAX_PREFIX_EXPANSIONS]:
+            if not word.startswith(token):
+                break
+            matches[word] = 1.0 if word == token else PREFIX_WEIGHT
+        if token not in matches:
+            for score, number in fuzzy_matches(
+                token, self.word_trigram_index, self.word_trigram_counts, MAX_FUZZY_MATCHES
+            ):
+                if score >= FUZZY_THRESHOLD:
+                    word = self.words[number]
+                    matches.setdefault(word, score * FUZZY_WEIGHT)
+        return matches
+
+    def posting_lists(self, matches):
+        """Finds the sorted lists of rows that some matched words point at. Returns them as
+        [rows, start, end, weight] lists, meaning rows[start:end], best weight first."""
+        library = self.library
+        by_weight = {}
+        for word, weight in matches.items():
+            weight_lists = by_weight.setdefault(weight, [])
+            rows = self.title_postings.get(word)
+            if rows:
+                weight_lists.append([rows, 0, len(rows), weight])
+            for code in self.artist_postings.get(word, ()):
+                start, end = library.artist_starts[code], library.artist_starts[code + 1]
+                weight_lists.append([library.artist_rows, start, end, weight])
+
+        lists = []
+        for weight, weight_lists in by_weight.items():
+            if len(weight_lists) > MAX_POSTING_LISTS:
+                # A word in lots of artists' names has lots of short lists, which are
+                # quicker to sort into one list than to merge or search one at a time.
+                # A row can be in both a title list and an artist list, so the set
+                # makes sure it's only listed once.
+                rows = array("l", sorted(set(chain.from_iterable(
+                    rows[start:end] for rows, start, end, _ in weight_lists
+                ))))
+                weight_lists = [[rows, 0, len(rows), weight]]
+            lists.extend(weight_lists)
+        lists.sort(key=lambda posting: -posting[3])
+        return lists
+
+    def token_scores(self, matches):
+        """Works out which rows contain any of the matched words, and how well they match"""
+        scores = {}
+        for rows, start, end, weight in self.posting_lists(matches):
+            for row in rows[start:end]:
+                if scores.get(row, 0) < weight:
+                    scores[row] = weight
+        return scores
+
+    def search(self, query, limit=10):
+        """Returns the rows that best match the query, best first. Songs have to match
+        every word in the query, unless nothing does, in which case any word will do."""
+        token_matches = [self.word_matches(token) for token in set(tokenize(query))]
+        if not token_matches or limit <= 0:
+            return []
+        token_lists = sorted(
+            (self.posting_lists(matches) for matches in token_matches),
+            key=lambda lists: sum(end - start for _, start, end, _ in lists),
+        )
+
+        best = []
+        if all(token_lists):
+            best = top_matches(token_lists, limit)
+        if not best:
+            totals = {}
+            for matches in token_matches:
+                for row, score in self.token_scores(matches).items():
+                    totals[row] = totals.get(row, 0) + score
+            best = heapq.nlargest(limit, ((score, -row) for row, score in totals.items()))
+        return [-negative_row for score, negative_row in sorted(best, reverse=True)]
+
+    def suggest_artists(self, text, limit=5):
+        """Returns the names of the artists that look most like the given text"""
+        matches = fuzzy_matches(
+            text.lower(), self.artist_trigram_index, self.artist_trigram_counts, limit
+        )
+        return [
+            self.library.artist_names[code]
+            for score, code in matches
+            if score >= ARTIST_SUGGESTION_THRESHOLD
+        ]
+
+
+"""Yields (row, weight) for every row in some posting lists (see SearchIndex.posting_lists),
+in row order. Rows that are in more than one list are given the best of their weights."""
+def merged_rows(lists):
+    if len(lists) == 1:
+        rows, start, end, weight = lists[0]
+        for row in rows[start:end]:
+            yield row, weight
+        return
+    previous = None
+    merged = heapq.merge(
+        *[zip(rows[start:end], repeat(-weight)) for rows, start, end, weight in lists]
+    )
+    for row, negative_weight in merged:
+        # The best weight for each row comes first, because the weights are negated
+        if row != previous:
+            previous = row
+            yield row, -negative_weight
+
+
+"""Returns the weight of the best posting list (see SearchIndex.posting_lists) that has a
+row in it, or 0 if none do. Rows have to be looked up in increasing order, because each
+list's start is moved up to where the row would be, to narrow the next binary search."""
+def posting_weight(lists, row):
+    for posting in lists:
+        rows, start, end, weight = posting
+        position = bisect_left(rows, row, start, end)
+        posting[1] = position
+        if position < end and rows[position] == row:
+            return weight
+    return 0
+
+
+"""Finds the rows that are in at least one posting list for every search word, and keeps
+the best limit of them as a heap of (score, -row). The rows of the rarest word are
+merged in row order and looked up in the other words' lists by binary search, so no row
+has to be read. Ties go to the lowest row, so once the heap is full of rows with the best
+score possible, none of the rows after them can get in and the search stops early."""
+def top_matches(token_lists, limit):
+    best_possible = sum(lists[0][3] for lists in token_lists)
+    best = []
+    for row, score in merged_rows(token_lists[0]):
+        for lists in token_lists[1:]:
+            weight = posting_weight(lists, row)
+            if not weight:
+                break
+            score += weight
+        else:
+            entry = (score, -row)
+            if len(best) < limit:
+                heapq.heappush(best, entry)
+            elif entry > best[0]:
+                heapq.heapreplace(best, entry)
+            if len(best) == limit and best[0][0] >= best_possible:
+                break
+    return best
+
+
+"""Works out where each value would come in sorted order, with equal values sharing a rank"""
+def ranks(values):
+    values = list(values)
+    value_ranks = {value: rank for rank, value in enumerate(sorted(set(values)))}
+    return [value_ranks[value] for value in values]
+
+
+"""Inserts a row into an array of rows that's sorted by sort_key(order, row), keeping
+it sorted. Only the rows that the binary search lands on have their keys worked out."""
+def insert_sorted(rows, row, order, sort_key):
+    target = sort_key(order, row)
+    low, high = 0, len(rows)
+    while low < high:
+        middle = (low + high) // 2
+        if sort_key(order, rows[middle]) < target:
+            low = middle + 1
+        else:
+            high = middle
+    rows.insert(low, row)
+
+
+class SongLibrary:
+    """Keeps the songs from a library CSV file in memory, along with indexes for
+    looking them up by ID, artist, genre and length. The file is only parsed again
+    when its modification time or size changes.
+
+    Songs are stored in columns rather than as one dict per song: IDs and lengths
+    are packed into arrays, artists and genres are stored once each and referenced
+    by code, and all the titles share one string. Rows are handed out as Song views."""
+
+    def __init__(self, filename):
+        self.filename = os.fspath(filename)
+        self.snapshot_filename = self.filename + ".snapshot"
+        self.file_signature = None
+        self.saves_on_exit = False
+        self.clear()
+
+    def clear(self):
+        self.ids = array("q")
+        self.lengths = array("l")
+        self.artist_codes = array("l")
+        self.genre_codes = array("l")
+        self.artist_names = []
+        self.genre_names = []
+        self.artist_lookup = {}
+        self.genre_lookup = {}
+        # Titles are stored back-to-back, with the title for row r found at
+        # title_store[title_offsets[r]:title_offsets[r + 1]]. The titles of songs added
+        # since then are kept in a list, and only joined on when a snapshot is saved.
+        self.title_store = ""
+        self.title_offsets = array("q", [0])
+        self.added_titles = []
+        # Whether songs have been added since the snapshot was last saved
+        self.snapshot_stale = False
+        # Indexes, which are all arrays of row numbers
+        self.id_rows = None
+        self.artist_rows, self.artist_starts = array("l"), array("l", [0])
+        self.genre_rows, self.genre_starts = array("l"), array("l", [0])
+        self.length_order = array("l")
+        self.sorted_lengths = array("l")
+        # Each genre's rows from genre_starts, sorted from shortest to longest
+        self.genre_length_rows = array("l")
+        self.genre_sorted_lengths = array("l")
+        self.title_order = array("l")
+        self.artist_order = array("l")
+        self.genre_order = array("l")
+        self.rejected_count = 0
+        self.search_index = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def refresh(self):
+        """Loads the file again if it has changed since we last parsed it"""
+        try:
+            stats = os.stat(self.filename)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Could not access {self.filename}!")
+
+        signature = (stats.st_mtime_ns, stats.st_size)
+        if signature != self.file_signature:
+            with file_lock(self.filename):
+                # Check again now that nobody can be halfway through writing the file
+                stats = os.stat(self.filename)
+                signature = (stats.st_mtime_ns, stats.st_size)
+                with metrics.timer("library: load snapshot"):
+                    loaded = self.load_snapshot(signature)
+                if not loaded:
+                    with metrics.timer("library: parse CSV"):
+                        self.load()
+                    with metrics.timer("library: save snapshot"):
+                        self.save_snapshot(signature)
+                metrics.count("rows read: library", len(self))
+                self.file_signature = signature
+        return self
+
+    def code_for(self, lookup, names, value):
+        code = lookup.get(value)
+        if code is None:
+            code = len(names)
+            lookup[value] = code
+            names.append(value)
+        return code
+
+    def load(self):
+        self.clear()
+        titles = io.StringIO()
+        title_end = 0
+        report = RejectReport(self.filename + ".rejects")
+        try:
+            for id, artist, title, length, genre in iter_library_rows(
+                self.filename, report.reject
+            ):
+                self.ids.append(id)
+                self.artist_codes.append(
+                    self.code_for(self.artist_lookup, self.artist_names, artist)
+                )
+                title_end += titles.write(title)
+                self.title_offsets.append(title_end)
+                self.lengths.append(length)
+                self.genre_codes.append(
+                    self.code_for(self.genre_lookup, self.genre_names, genre)
+                )
+        finally:
+            report.close()
+        self.rejected_count = report.count
+
+        self.title_store = titles.getvalue()
+        self.build_indexes()
+
+    def load_snapshot(self, signature):
+        """Loads the library from the binary snapshot next to the CSV file, if there is one
+        and it was made from the current version of the file. Returns False otherwise."""
+        try:
+            with open(self.snapshot_filename, "rb") as snapshot_file:
+                snapshot = snapshot_file.read()
+        except FileNotFoundError:
+            return False
+
+        if len(snapshot) < SNAPSHOT_HEADER.size:
+            return False
+        magic, version, byte_order, mtime_ns, size, digest, rejected_count = (
+            SNAPSHOT_HEADER.unpack_from(snapshot)
+        )
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            return False
+        if byte_order != sys.byteorder[0].encode() or size != signature[1]:
+            return False
+        # The modification time changes if the file is just touched or copied, so fall
+        # back to comparing the contents before deciding the snapshot is out of date
+        if mtime_ns != signature[0]:
+            if digest != file_digest(self.filename):
+                return False
+            self.update_snapshot_mtime(snapshot, signature[0])
+
+        # The snapshot is only a cache, so if it has been cut short or corrupted (e.g. by
+        # a crash or a full disk while it was being written), the CSV is parsed instead
+        sections = []
+        position = SNAPSHOT_HEADER.size
+        try:
+            while position < len(snapshot):
+                typecode, itemsize, byte_count = SNAPSHOT_SECTION.unpack_from(snapshot, position)
+                position += SNAPSHOT_SECTION.size
+                if position + byte_count > len(snapshot):
+                    return False
+                data = snapshot[position : position + byte_count]
+                position += byte_count
+                if typecode == b"s":
+                    sections.append(data.decode())
+                    continue
+                column = array(typecode.decode())
+                if column.itemsize != itemsize:
+                    # The snapshot was made on a platform with different sized integers
+                    return False
+                column.frombytes(data)
+                sections.append(column)
+        except (struct.error, ValueError):
+            # ValueError covers an unknown typecode, a section that isn't a whole number
+            # of items, and text that isn't valid UTF-8
+            return False
+
+        if not snapshot_sections_agree(sections):
+            return False
+        self.clear()
+        for name, column in zip(SNAPSHOT_ARRAYS, sections):
+            setattr(self, name, column)
+        self.title_store = sections[-3]
+        self.artist_names = sections[-2].split("\0") if sections[-2] else []
+        self.genre_names = sections[-1].split("\0") if sections[-1] else []
+        self.artist_lookup = {name: code for code, name in enumerate(self.artist_names)}
+        self.genre_lookup = {name: code for code, name in enumerate(self.genre_names)}
+        self.id_rows = None if self.ids_in_order() else {id: row for row, id in enumerate(self.ids)}
+        self.rejected_count = rejected_count
+        return True
+
+    def update_snapshot_mtime(self, snapshot, mtime_ns):
+        """Updates the modification time in a snapshot's header, once we've checked that
+        the CSV file's contents are still the same, so we don't have to hash it next time"""
+        header = list(SNAPSHOT_HEADER.unpack_from(snapshot))
+        header[3] = mtime_ns
+        try:
+            with open(self.snapshot_filename, "r+b") as snapshot_file:
+                snapshot_file.write(SNAPSHOT_HEADER.pack(*header))
+        except OSError:
+            pass
+
+    def save_snapshot(self, signature):
+        """Saves the parsed library and its indexes, so that the next load is quick"""
+        if self.added_titles:
+            for title in self.added_titles:
+                self.title_offsets.append(self.title_offsets[-1] + len(title))
+            self.title_store += "".join(self.added_titles)
+            self.added_titles = []
+        self.snapshot_stale = False
+        header = SNAPSHOT_HEADER.pack(
+            SNAPSHOT_MAGIC,
+            SNAPSHOT_VERSION,
+            sys.byteorder[0].encode(),
+            signature[0],
+            signature[1],
+            file_digest(self.filename),
+            self.rejected_count,
+        )
+        strings = [
+            self.title_store,
+            "\0".join(self.artist_names),
+            "\0".join(self.genre_names),
+        ]
+        temporary_path = f"{self.snapshot_filename}.{os.getpid()}.tmp"
+        try:
+            with open(temporary_path, "wb") as snapshot_file:
+                snapshot_file.write(header)
+                for name in SNAPSHOT_ARRAYS:
+                    column = getattr(self, name)
+                    data = column.tobytes()
+                    snapshot_file.write(
+                        SNAPSHOT_SECTION.pack(column.typecode.encode(), column.itemsize, len(data))
+                    )
+                    snapshot_file.write(data)
+                for string in strings:
+                    data = string.encode()
+                    snapshot_file.write(SNAPSHOT_SECTION.pack(b"s", 1, len(data)))
+                    snapshot_file.write(data)
+            os.replace(temporary_path, self.snapshot_filename)
+        except OSError:
+            # The snapshot is only a cache, so it's fine if it can't be written
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+    def ids_in_order(self):
+        ids = self.ids
+        return all(ids[row] < ids[row + 1] for row in range(len(ids) - 1))
+
+    def build_indexes(self):
+        ids = self.ids
+        # Sorted IDs can be bisected directly, so we only need a dict for unsorted files
+        self.id_rows = None if self.ids_in_order() else {id: row for row, id in enumerate(ids)}
+
+        self.artist_rows, self.artist_starts = group_rows(
+            self.artist_codes, len(self.artist_names)
+        )
+        self.genre_rows, self.genre_starts = group_rows(
+            self.genre_codes, len(self.genre_names)
+        )
+        self.length_order = array(
+            "l", sorted(range(len(ids)), key=self.lengths.__getitem__)
+        )
+        self.sorted_lengths = array("l", (self.lengths[row] for row in self.length_order))
+
+        # Walking through the rows in length order and dropping them into their
+        # genre's section keeps each section sorted by length
+        self.genre_length_rows = array("l", [0]) * len(ids)
+        positions = self.genre_starts[:-1]
+        for row in self.length_order:
+            code = self.genre_codes[row]
+            self.genre_length_rows[positions[code]] = row
+            positions[code] += 1
+        self.genre_sorted_lengths = array(
+            "l", (self.lengths[row] for row in self.genre_length_rows)
+        )
+
+        # Sorting by title first means the stable sorts by artist and genre keep songs
+        # with the same artist or genre in title order
+        self.title_order = array(
+            "l", sorted(range(len(ids)), key=lambda row: self.title(row).lower())
+        )
+        artist_ranks = ranks(name.lower() for name in self.artist_names)
+        self.artist_order = array(
+            "l",
+            sorted(self.title_order, key=lambda row: artist_ranks[self.artist_codes[row]]),
+        )
+        genre_ranks = ranks(self.genre_names)
+        self.genre_order = array(
+            "l",
+            sorted(self.title_order, key=lambda row: genre_ranks[self.genre_codes[row]]),
+        )
+
+    def sort_key(self, order, row):
+        """The key that each of the sort orders is sorted by, used to insert new rows"""
+        title = self.title(row).lower()
+        if order == "title":
+            return (title, row)
+        if order == "artist":
+            return (self.artist_names[self.artist_codes[row]].lower(), title, row)
+        if order == "genre":
+            return (self.genre_names[self.genre_codes[row]], title, row)
+        return (self.lengths[row], row)
+
+    def sorted_rows(self, order):
+        """Returns the rows of the library sorted by "title", "artist", "length" or "genre"."""
+        return getattr(self.refresh(), SORT_ORDERS[order])
+
+    def title(self, row):
+        offsets = self.title_offsets
+        if row < len(offsets) - 1:
+            return self.title_store[offsets[row] : offsets[row + 1]]
+        return self.added_titles[row - len(offsets) + 1]
+
+    def save_stale_snapshot(self):
+        """Saves the snapshot if songs have been added since it was last saved, as long as
+        library.csv hasn't been changed by anything else in the meantime"""
+        if not self.snapshot_stale:
+            return
+        with file_lock(self.filename):
+            stats = os.stat(self.filename)
+            if (stats.st_mtime_ns, stats.st_size) == self.file_signature:
+                self.save_snapshot(self.file_signature)
+
+    def song(self, row):
+        return Song(self, row)
+
+    def iter_songs(self, rows):
+        """Like songs(), but hands out the songs one at a time instead of making a list"""
+        for row in rows:
+            yield Song(self, row)
+
+    def songs(self, rows=None):
+        self.refresh()
+        if rows is None:
+            rows = range(len(self))
+        return [Song(self, row) for row in rows]
+
+    def row_for_id(self, id):
+        if self.id_rows is not None:
+            return self.id_rows.get(id)
+        row = bisect_left(self.ids, id)
+        if row < len(self.ids) and self.ids[row] == id:
+            return row
+        return None
+
+    def get_many(self, ids):
+        """Looks up a batch of song IDs at once, skipping any that aren't in the library"""
+        self.refresh()
+        rows = (self.row_for_id(id) for id in ids)
+        return [Song(self, row) for row in rows if row is not None]
+
+    def get(self, id):
+        row = self.refresh().row_for_id(id)
+        if row is None:
+            raise LookupError(f"Could not find a song in the library with an ID of {id}")
+        return Song(self, row)
+
+    def artist_song_rows(self, artist):
+        code = self.refresh().artist_lookup.get(artist)
+        if code is None:
+            return array("l")
+        return self.artist_rows[self.artist_starts[code] : self.artist_starts[code + 1]]
+
+    def genre_song_rows(self, genre):
+        code = self.refresh().genre_lookup.get(genre)
+        if code is None:
+            return array("l")
+        return self.genre_rows[self.genre_starts[code] : self.genre_starts[code + 1]]
+
+    def from_artist(self, artist):
+        return self.songs(self.artist_song_rows(artist))
+
+    def from_genre(self, genre):
+        return self.songs(self.genre_song_rows(genre))
+
+    def length_range(self, min_length=0, max_length=None, genre=None):
+        """Finds the songs that are between min_length and max_length seconds long
+        (inclusive), optionally from one genre. Returns (index, start, end), where the
+        songs' rows are getattr(self, index)[start:end], from shortest to longest."""
+        self.refresh()
+        if genre is None:
+            index, lengths = "length_order", self.sorted_lengths
+            low, high = 0, len(lengths)
+        else:
+            code = self.genre_lookup.get(genre)
+            if code is None:
+                return "length_order", 0, 0
+            index, lengths = "genre_length_rows", self.genre_sorted_lengths
+            low, high = self.genre_starts[code], self.genre_starts[code + 1]
+
+        start = bisect_left(lengths, min_length, low, high)
+        end = high if max_length is None else bisect_right(lengths, max_length, low, high)
+        return index, start, end
+
+    def length_range_rows(self, min_length=0, max_length=None, genre=None):
+        """Returns the rows of the songs that are between min_length and max_length
+        seconds long (inclusive), from shortest to longest. If a genre is given, only
+        songs from that genre are included."""
+        index, start, end = self.length_range(min_length, max_length, genre)
+        return getattr(self, index)[start:end]
+
+    def songs_in_range(self, min_length=0, max_length=None, genre=None, exclude=()):
+        """Returns the songs between min_length and max_length seconds long, optionally
+        from one genre. exclude can be a set or SongBitmap of song IDs to leave out."""
+        rows = self.length_range_rows(min_length, max_length, genre)
+        if not exclude:
+            return self.songs(rows)
+        ids = self.ids
+        return self.songs([row for row in rows if ids[row] not in exclude])
+
+    def shorter_than(self, max_length, exclude=()):
+        """Returns all songs that are at most max_length seconds long"""
+        return self.songs_in_range(0, max_length, exclude=exclude)
+
+    def artists(self):
+        return self.refresh().artist_lookup.keys()
+
+    def sorted_by_title(self):
+        return self.songs(self.sorted_rows("title"))
+
+    def searcher(self):
+        """Returns the search index, which is built the first time it's needed"""
+        self.refresh()
+        if self.search_index is None:
+            self.search_index = SearchIndex(self)
+        return self.search_index
+
+    def search(self, query, limit=10):
+        return self.songs(self.searcher().search(query, limit))
+
+    def suggest_artists(self, text, limit=5):
+        return self.searcher().suggest_artists(text, limit)
+
+    def add_song(self, artist, title, length, genre):
+        """Adds a song to the end of the CSV file, and slots it into the in-memory columns
+        and indexes without re-sorting or re-parsing anything. Returns the new song."""
+        with file_lock(self.filename, exclusive=True):
+            self.refresh()
+            if len(self) == 0:
+                id = 1
+            elif self.id_rows is None:
+                id = self.ids[-1] + 1
+            else:
+                id = max(self.ids) + 1
+
+            # Check the song the same way as the rows of the file, before anything is
+            # written, so that it can't be lost on the next reload or leave the columns
+            # half updated
+            reason = validate_song_row([str(id), artist, title, str(length), genre], ())
+            if reason is not None:
+                raise ValueError(f"The song {reason}")
+
+            line = io.StringIO()
+            csv.writer(line, lineterminator="\n").writerow([id, artist, title, length, genre])
+            with open(self.filename, "rb+") as library_csv:
+                library_csv.seek(0, os.SEEK_END)
+                if library_csv.tell() > 0:
+                    library_csv.seek(-1, os.SEEK_END)
+                    if library_csv.read(1) != b"\n":
+                        library_csv.write(b"\n")
+                library_csv.write(line.getvalue().encode())
+
+            row = len(self)
+            self.ids.append(id)
+            if self.id_rows is not None:
+                self.id_rows[id] = row
+            self.lengths.append(length)
+            self.added_titles.append(title)
+
+            artist_code = self.code_for(self.artist_lookup, self.artist_names, artist)
+            self.artist_codes.append(artist_code)
+            if artist_code == len(self.artist_starts) - 1:
+                self.artist_starts.append(self.artist_starts[-1])
+            self.artist_rows.insert(self.artist_starts[artist_code + 1], row)
+            for code in range(artist_code + 1, len(self.artist_starts)):
+                self.artist_starts[code] += 1
+
+            genre_code = self.code_for(self.genre_lookup, self.genre_names, genre)
+            self.genre_codes.append(genre_code)
+            if genre_code == len(self.genre_starts) - 1:
+                self.genre_starts.append(self.genre_starts[-1])
+            section_start = self.genre_starts[genre_code]
+            section_end = self.genre_starts[genre_code + 1]
+            self.genre_rows.insert(section_end, row)
+            position = bisect_right(
+                self.genre_sorted_lengths, length, section_start, section_end
+            )
+            self.genre_length_rows.insert(position, row)
+            self.genre_sorted_lengths.insert(position, length)
+            for code in range(genre_code + 1, len(self.genre_starts)):
+                self.genre_starts[code] += 1
+
+            position = bisect_right(self.sorted_lengths, length)
+            self.length_order.insert(position, row)
+            self.sorted_lengths.insert(position, length)
+            for order in ("title", "artist", "genre"):
+                insert_sorted(getattr(self, SORT_ORDERS[order]), row, order, self.sort_key)
+
+            stats = os.stat(self.filename)
+            self.file_signature = (stats.st_mtime_ns, stats.st_size)
+            # Saving the snapshot hashes and writes the whole library, so rather than
+            # doing that for every song, it's saved once when the program exits
+            self.snapshot_stale = True
+            if not self.saves_on_exit:
+                atexit.register(self.save_stale_snapshot)
+                self.saves_on_exit = True
+            self.search_index = None
+        return Song(self, row)
+
+
+def format_song(song):
+    return f"{song['title']} ({song['artist']}) ({parse_seconds(song['length'])})"
+
+
+"""Turns some songs into the contents of an export file, in one of the EXPORT_FORMATS:
+"txt" (one title per line), "jsonl" (one JSON object per song) or "m3u" (a playlist)"""
+def format_export(songs, format="txt"):
+    if format == "jsonl":
+        import json
+
+        return "".join(json.dumps(dict(song)) + "\n" for song in songs)
+    if format == "m3u":
+        entries = [
+            f"#EXTINF:{song['length']},{song['artist']} - {song['title']}\nocrtunes:song:{song['id']}\n"
+            for song in songs
+        ]
+        return "#EXTM3U\n" + "".join(entries)
+    return "".join(song["title"] + "\n" for song in songs)
+
+
+"""Works out which export format to use from a file's extension, defaulting to plain text"""
+def export_format_for(filepath):
+    extension = os.path.splitext(filepath)[1].lstrip(".").lower()
+    return extension if extension in EXPORT_FORMATS else "txt"
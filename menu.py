@@ -0,0 +1,547 @@
+"""The interactive menu, and the prompts that it uses to ask for input"""
+from datetime import date
+from types import FunctionType
+import math
+import sys
+import re
+import random
+
+from instrumentation import metrics
+from library import (
+    GENRES,
+    MAX_SONG_LENGTH,
+    SEARCH_RESULT_COUNT,
+    SORT_ORDERS,
+    parse_seconds,
+    format_song,
+    format_export,
+    export_format_for,
+)
+from accounts import JOURNAL_COMPACT_ENTRIES
+from ocrtunes import (
+    catalogue,
+    accounts,
+    candidate_pools,
+    playlists,
+    state,
+    get_account,
+    reload_user,
+    update_user,
+    build_playlist,
+)
+
+# Terminal colour codes
+COLOR_RED = "\x1b[31m"
+
+# The formats that date_input() and time_input() accept
+DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+MINUTES_PATTERN = re.compile(r"\d+:\d+")
+
+
+"""Converts an array in the format [year, month, day] to the ISO data format"""
+def iso_date(parts):
+    return "-".join([str(part) for part in parts])
+
+
+"""Applies an ANSI colour code to a string"""
+def color_wrap(string, color):
+    return f"{color}{string}\033[0m"
+
+
+"""System for creating a menu with multiple options that the user can pick from"""
+def create_menu(title=None):
+    options = []
+
+    """Add an option to the menu.
+    name: The text that is shown to the user, in the menu
+    callback: The function to run when the user selects the option
+    show: An optional function that can return False to prevent the option from being shown
+    """
+    def add_option(name, callback, show=None):
+        # Only give the callback function an argument if it wants one. This is worked out
+        # once here, rather than every time the option is picked, and inspect (which is
+        # slow to import) is only needed for callbacks that aren't plain functions.
+        if isinstance(callback, FunctionType):
+            wants_cleanup = callback.__code__.co_argcount > 0
+        else:
+            from inspect import signature
+
+            wants_cleanup = len(signature(callback).parameters) > 0
+        options.append(
+            {"name": name, "callback": callback, "show": show, "wants_cleanup": wants_cleanup}
+        )
+
+    """Run the callback of the option that the user picked"""
+    def run_option(option):
+        """Cleanup functions run once the menu item callback is done, i.e. if the function ends normally or if it's cancelled by the user with ^C. Useful for things like closing files."""
+        def add_cleanup(cleanup):
+            cleanups.append(cleanup)
+
+        cleanups = []
+
+        arguments = (add_cleanup,) if option["wants_cleanup"] else ()
+        try:
+            metrics.run_action(option["name"], option["callback"], *arguments)
+        except KeyboardInterrupt:
+            message = "Aborting..." if len(cleanups) else "Aborted!"
+            print(color_wrap("\n" + message, COLOR_RED))
+        finally:
+            for cleanup in cleanups:
+                cleanup()
+
+    """Show the menu (once you've added all the options). With loop=True, the menu is
+    shown again after each option has run, until the user enters 0."""
+    def show_menu(loop=False):
+        while True:
+            relevant_options = []
+            for option in options:
+                if option["show"]:
+                    shouldShow = option["show"]()
+                    if shouldShow:
+                        relevant_options.append(option)
+                else:
+                    relevant_options.append(option)
+
+            if len(relevant_options) == 0:
+                print("No options available. Goodbye!")
+                return
+
+            if title:
+                print(title)
+            for i, option in enumerate(relevant_options):
+                print(f"{i+1}) {option['name']}")
+
+            selection = get_selection(len(relevant_options))
+            if selection == -1:
+                # Exit the menu if the user entered "0" (to cancel the selection)
+                return
+
+            print()
+            run_option(relevant_options[selection])
+
+            if not loop:
+                return
+            print("\n")
+
+    return add_option, show_menu
+
+
+def get_selection(max):
+    while True:
+        try:
+            raw_input = input("Make a selection: ")
+        except KeyboardInterrupt:
+            print(color_wrap("Selection cancelled!", COLOR_RED))
+            return -1
+
+        if not raw_input.isnumeric():
+            print("Your selection must be a positive number!")
+            continue
+
+        selection = int(raw_input)
+        if selection < 0:
+            print("Select a positive number!")
+            continue
+        if selection > max:
+            print("Selection out of bounds: Must be below", max)
+            continue
+
+        # Subtract one from the selection, since the user is given options that are
+        # indexed from 1, but we want them to be zero-indexed
+        selection -= 1
+        return selection
+
+
+"""Asks the user for some input and validates that they actually entered something"""
+def text_input(prompt, default=None):
+    while True:
+        raw_input = input(prompt)
+        if default != None and raw_input == "":
+            return default
+        if raw_input:
+            return raw_input
+        print("Enter at least one character!")
+
+
+"""Validates the format of a date in the YYYY-MM-DD format, paritally validates the date, parses it, and returns it as an array in the form [year, month, day]. Raises a ValueError (with a message for the user) if it isn't valid."""
+def parse_date(raw_input):
+    # Only accept the YYYY-MM-DD format
+    if not DATE_PATTERN.search(raw_input):
+        raise ValueError("Please follow the correct format when entering the date!")
+
+    # Extract the year, month and day form the inputted value
+    input_parts = raw_input.split("-")
+    year = int(input_parts[0])
+    month = int(input_parts[1])
+    day = int(input_parts[2])
+
+    # Basic date validation because dates are hard
+    # TODO: Don't look at this again
+    current_year = date.today().year
+    if year > current_year:
+        raise ValueError(f"The provided year is {year - current_year} years in the future!")
+    if month > 12:
+        raise ValueError("You cannot have a month number greater than 12!")
+    if day > 31:
+        raise ValueError("You cannot have a month number greater than 31!")
+
+    return [year, month, day]
+
+
+"""Asks the suer for some input in the YYYY-MM-DD format, and returns it as an array in the form [year, month, day]."""
+def date_input(prompt):
+    while True:
+        raw_input = input(f"{prompt}: (YYYY-MM-DD) ").strip()
+        try:
+            return parse_date(raw_input)
+        except ValueError as error:
+            print(error)
+
+
+"""Parses a length of time, in minutes. Accepts two formats of input:
+a) A number of minutes as a decimal: e.g. '52', '8.1'
+b) A number of minutes and seconds spereated by a colon: e.g '2:30'
+Raises a ValueError (with a message for the user) if it's in neither format."""
+def parse_minutes(raw_input):
+    minutes = 0
+    seconds = 0
+    if not raw_input:
+        raise ValueError("You have to enter something!")
+    elif MINUTES_PATTERN.search(raw_input):
+        parts = raw_input.split(":")
+        minutes = int(parts[0])
+        seconds = int(parts[1])
+    elif raw_input.replace(".", "").isnumeric():
+        minutes = float(raw_input)
+    else:
+        raise ValueError("Enter a number!")
+
+    try:
+        total = minutes + (seconds / 60)
+    except OverflowError:
+        total = math.inf
+    # A long enough string of digits is parsed as infinity
+    if not math.isfinite(total):
+        raise ValueError("That's far too long!")
+    return total
+
+
+"""Asks the user for some input, in minutes (in either of the formats that parse_minutes() accepts)"""
+def time_input(prompt):
+    while True:
+        raw_input = input(f"{prompt}: (mins) ")
+        try:
+            return parse_minutes(raw_input)
+        except ValueError as error:
+            print(error)
+
+
+"""Asks the user for the length of a song, in minutes. Returns it in whole seconds."""
+def song_length_input(prompt):
+    while True:
+        seconds = time_input(prompt) * 60
+        # A big enough number of minutes is still infinite once it's in seconds
+        if math.isfinite(seconds) and round(seconds) <= MAX_SONG_LENGTH:
+            return round(seconds)
+        print("That's far too long for a song!")
+
+
+"""Asks the user for their name. Returns their input in title case."""
+def name_input():
+    while True:
+        raw_input = input("Enter your name: ")
+        if len(raw_input) >= 1:
+            return raw_input.title()
+        print("Your name must be at least one letter!")
+
+
+"""Asks the user for some input. Their input must be a valid genre."""
+def genre_input(prompt):
+    while True:
+        raw_input = text_input(prompt).lower()
+        if raw_input in GENRES:
+            return raw_input
+        print("That's not a valid genre!")
+        print("Available genres:", ", ".join(GENRES))
+
+
+"""Asks the user for some input. Their input must match an artist found in the song library."""
+def artist_input(prompt):
+    while True:
+        valid_artists = catalogue.artists()
+
+        raw_input = text_input(prompt)
+        if raw_input in valid_artists:
+            return raw_input
+
+        suggestions = catalogue.suggest_artists(raw_input)
+        print("There aren't any songs with that artist!")
+        if suggestions:
+            print("Did you mean:", ", ".join(suggestions))
+
+
+def new_file_input(prompt):
+    from pathlib import Path
+
+    # Keep showing the prompt until the input is valid
+    while True:
+        raw_input = text_input(prompt)
+        filepath = Path(raw_input)
+
+        if filepath.is_file():
+            print("There's already a file at that location!")
+        elif filepath.is_dir():
+            print("That filepath is a directory!")
+        elif filepath.exists():
+            print("Something already exists at that location!")
+        else:
+            return filepath
+
+
+def print_song(song):
+    print(format_song(song))
+
+
+def print_heading():
+    cyan = "\x1b[36m"
+    reset = "\x1b[0m"
+    blue = "\x1b[1;34m"
+    ASCII_ART = """\
+ _____  _____ ______  _                            
+|  _  |/  __ \| ___ \| |                           
+| | | || /  \/| |_/ /| |_  _   _  _ __    ___  ___ 
+| | | || |    |    / | __|| | | || '_ \  / _ \/ __|
+\ \_/ /| \__/\| |\ \ | |_ | |_| || | | ||  __/\__ \\
+ \___/  \____/\_| \_| \__| \__,_||_| |_| \___||___/"""
+    TAGLINES = [
+        "Find your new favourite artist with OCRtunes.",
+        "If you can't find it on OCtunes, it doesn't exist.",
+        "Music to your ears",
+        "Your perfect playlist, every time.",
+    ]
+    print(blue + ASCII_ART + reset)
+    ascii_art_width = 51
+    tagline = random.choice(TAGLINES)
+    padding_width = (ascii_art_width - len(tagline)) // 2
+    print(padding_width * " " + cyan + tagline + reset)
+    print()
+
+
+def create_account():
+    name = name_input()
+    birth_date = date_input("Enter your date of birth")
+    favourite_artist = text_input("Enter your favourite artist: ")
+    favourite_genre = genre_input("Enter your favourite genre: ")
+    print("Thank you! Creating your account...")
+
+    accounts.add(name, iso_date(birth_date), favourite_artist, favourite_genre)
+    print("Successfully created account: welcome to OCRtunes!")
+
+
+def pick_account():
+    default = state["old_user"] if "old_user" in state else ""
+    prompt_suffix = f"({default}) " if default else ""
+    prompt = "Enter your name: " + prompt_suffix
+
+    while True:
+        username = text_input(prompt, default).title()
+        matched_account = get_account(username)
+        if matched_account:
+            break
+        print("Could not find an account with that name!")
+
+    state["user"] = matched_account
+    name = state["user"]["name"]
+    print(f'Successfully logged in to account "{name}": welcome back to OCRtunes!')
+
+
+def log_out():
+    try:
+        input("Press enter to log out...")
+    except KeyboardInterrupt:
+        return print(color_wrap(" Aborted!", COLOR_RED))
+
+    state["old_user"] = state["user"]["name"]
+    state.pop("user")
+    print("Successfully logged out!")
+
+
+def edit_artist():
+    current_artist = state["user"]["favourite_artist"]
+    print(f'Your favourite artist is currently set to "{current_artist}"')
+    new_artist = text_input("Enter your new favourite artist: ")
+
+    update_user(2, new_artist)  # 2 is the index of the favourite artist column
+    reload_user()
+    candidate_pools.forget(state["user"]["name"])
+    print(f'Successfully changed your favourite artist to "{new_artist}"')
+
+
+def edit_genre():
+    current_genre = state["user"]["favourite_genre"]
+    print(f'Your favourite genre is currently set to "{current_genre}"')
+    new_genre = genre_input("Enter your new favourite genre: ")
+
+    update_user(3, new_genre)  # 3 is the index of the favourite genre column
+    reload_user()
+    candidate_pools.forget(state["user"]["name"])
+    print(f'Successfully changed your favourite genre to "{new_genre}"')
+
+
+def edit_interests():
+    add_option, show_menu = create_menu()
+    add_option("Edit favourite artist", edit_artist)
+    add_option("Edit favourite genre", edit_genre)
+    show_menu()
+
+
+"""Shows songs one screenful at a time, writing each screenful to the terminal at once"""
+def show_songs_paged(rows):
+    import shutil
+
+    page_size = max(1, shutil.get_terminal_size().lines - 2)
+    for start in range(0, len(rows), page_size):
+        page = catalogue.iter_songs(rows[start : start + page_size])
+        sys.stdout.write("".join(format_song(song) + "\n" for song in page))
+        sys.stdout.flush()
+        if start + page_size >= len(rows):
+            break
+        if input("Press enter to show more songs, or q to stop: ").strip().lower() == "q":
+            break
+
+
+"""Makes a menu callback that shows the library in the given sort order"""
+def show_sorted_library(order):
+    return lambda: show_songs_paged(catalogue.sorted_rows(order))
+
+
+def song_library():
+    add_option, show_menu = create_menu("Sort the library by:")
+    for order in SORT_ORDERS:
+        add_option(order.title(), show_sorted_library(order))
+    show_menu()
+
+
+def search_library():
+    query = text_input("Search for a song or artist: ")
+    results = catalogue.search(query, SEARCH_RESULT_COUNT)
+    if len(results) == 0:
+        print("Couldn't find any songs that match your search!")
+        return
+    for song in results:
+        print_song(song)
+
+
+def add_song():
+    artist = text_input("Artist: ")
+    title = text_input("Title: ")
+    length = song_length_input("Length")
+    genre = genre_input("Genre: ")
+    try:
+        song = catalogue.add_song(artist, title, length, genre)
+    except ValueError as error:
+        print(error)
+        return
+    print(f"Successfully added song {song['id']} to the library: {format_song(song)}")
+
+
+def make_playlist(best_fit):
+    time_limit = time_input("Maximum run time of playlist")
+    max_seconds = time_limit * 60
+    print()
+    print("Generating playlist...")
+    playlist = build_playlist(state["user"], max_seconds, best_fit)
+    if len(playlist) == 0:
+        print("There aren't any songs that are that short!")
+        return
+
+    songs = catalogue.get_many(playlist)
+    full_run_time = sum(song["length"] for song in songs)
+    print(f"Successfully made a playlist with {len(playlist)} songs!")
+    print(f"Playlist run time is {parse_seconds(full_run_time)}")
+    input("Press enter to view playlist...")
+
+    print()
+    show_songs(songs)
+
+    print()
+    if input("Save this playlist? (y/N) ").strip().lower() == "y":
+        playlists.save(state["user"]["name"], playlist)
+        print("Successfully saved your playlist!")
+
+
+def show_songs(songs):
+    sys.stdout.write("".join(format_song(song) + "\n" for song in songs))
+
+
+def view_playlists():
+    saved = playlists.playlists(state["user"]["name"])
+    if len(saved) == 0:
+        print("You haven't saved any playlists yet!")
+        return
+
+    for i, (day, ids_offset, song_count) in enumerate(saved):
+        print(f"{i+1}) {date.fromordinal(day).isoformat()}: {song_count} songs")
+    selection = get_selection(len(saved))
+    if selection == -1:
+        return
+
+    day, ids_offset, song_count = saved[selection]
+    songs = catalogue.get_many(playlists.song_ids(ids_offset, song_count))
+    full_run_time = sum(song["length"] for song in songs)
+    print(f"Playlist run time is {parse_seconds(full_run_time)}")
+    print()
+    show_songs(songs)
+
+
+def generate_playlist():
+    make_playlist(best_fit=False)
+
+
+def generate_best_fit_playlist():
+    make_playlist(best_fit=True)
+
+
+def export_songs():
+    print("This allows you to enter an artist's name and save all their songs to a text file.")
+    print("Use a .jsonl or .m3u file extension to save them in that format instead.")
+    artist = artist_input("Artist: ")
+    filepath = new_file_input("Filename: ")
+
+    matching_rows = catalogue.artist_song_rows(artist)
+    if len(matching_rows) == 0:
+        print("Could not find any songs that match that artist! (This is a bug in artist_input() or SongLibrary.artist_song_rows())")
+        return
+    
+    songs = catalogue.iter_songs(matching_rows)
+    with filepath.open("w") as file:
+        file.write(format_export(songs, export_format_for(filepath)))
+
+    count = len(matching_rows)
+    print(f"Successfully saved {count} song(s) from \"{artist}\" to file: {filepath}")
+
+
+def show_stats():
+    print(metrics.report())
+
+
+def run_menu():
+    if accounts.refresh().journal_entries >= JOURNAL_COMPACT_ENTRIES:
+        accounts.compact()
+    print_heading()
+    add_option, show_menu = create_menu("=== OCRtunes Main Menu ===")
+    add_option("Create an account", create_account, lambda: not "user" in state)
+    add_option("Log in", pick_account, lambda: not "user" in state)
+    add_option("Log out", log_out, lambda: "user" in state)
+    add_option("Edit interests", edit_interests, lambda: "user" in state)
+    add_option("Display song library", song_library)
+    add_option("Search the song library", search_library)
+    add_option("Add a song to the library", add_song)
+    add_option("Generate playlist", generate_playlist, lambda: "user" in state)
+    add_option(
+        "Generate best-fit playlist", generate_best_fit_playlist, lambda: "user" in state
+    )
+    add_option("View saved playlists", view_playlists, lambda: "user" in state)
+    add_option("Export songs from an artist", export_songs)
+    add_option("Show performance stats", show_stats, lambda: metrics.enabled)
+    show_menu(True)
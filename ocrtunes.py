@@ -0,0 +1,97 @@
+"""The shared state of OCRtunes: the song library, accounts and saved playlists that every
+interface (the menu, scripts, batch jobs and the HTTP server) works with, and functions
+for reading and changing them. Importing this doesn't read any files, because they're
+only loaded the first time that they're needed."""
+import random
+
+from instrumentation import metrics
+from library import SongLibrary, SongBitmap
+from accounts import AccountStore, account_from_row
+from playlists import PlaylistStore, CandidatePools, random_fill, best_fit_fill
+from shards import LibraryShards
+
+# The song library, which is kept in memory and only re-parsed when library.csv changes
+catalogue = SongLibrary("library.csv")
+
+# Runs the library scans that are big enough to be worth splitting across processes
+shards = LibraryShards(catalogue)
+
+# The accounts: a snapshot in accounts.csv (indexed by accounts.csv.idx) plus a
+# journal of changes in accounts.csv.journal
+accounts = AccountStore("accounts.csv")
+
+# Each account's pool of songs for generating playlists from
+candidate_pools = CandidatePools(catalogue)
+
+# Playlists that users have saved
+playlists = PlaylistStore("playlists.bin")
+
+# Global store for the state of the program (e.g. currently logged-in user)
+state = {}
+
+
+def reload_user():
+    """Brings the in-memory state up-to-date with the accounts.csv"""
+    username = state["user"]["name"]
+    matched_account = get_account(username)
+
+    if not matched_account:
+        raise LookupError(f'Couldn\'t find an account with the name "{username}"!')
+
+    state["user"] = matched_account
+
+
+def update_account(username, column, value):
+    accounts.update(username, column, value)
+
+
+@metrics.timed("update_user")
+def update_user(column, value):
+    update_account(state["user"]["name"], column, value)
+
+
+@metrics.timed("get_account", rows=lambda account: 1 if account else 0)
+def get_account(username):
+    return accounts.get(username)
+
+
+"""Goes through every account one at a time, so that they can all be processed without
+loading them all into memory"""
+def iter_accounts():
+    for columns in accounts:
+        yield account_from_row(columns)
+
+
+@metrics.timed("get_library", rows=len)
+def get_library():
+    return catalogue.songs()
+
+
+def sort_library():
+    return catalogue.sorted_by_title()
+
+
+def get_song(id):
+    return catalogue.get(id)
+
+
+"""Returns the songs that are at most max_length seconds long. exclude should be a set
+or SongBitmap of song IDs, so that checking each song against it is cheap."""
+@metrics.timed("get_short_songs", rows=len)
+def get_short_songs(max_length, exclude=()):
+    if not isinstance(exclude, (set, frozenset, SongBitmap)):
+        exclude = set(exclude)
+    return shards.songs_in_range(0, max_length, exclude=exclude)
+
+
+def get_songs_from_artist(artist):
+    return catalogue.from_artist(artist)
+
+
+"""Picks the songs for a playlist that's at most max_seconds long, for the given account.
+Returns a list of song IDs."""
+def build_playlist(account, max_seconds, best_fit=False, rng=random):
+    fill = best_fit_fill if best_fit else random_fill
+    pool = candidate_pools.pool_for(account)
+    rows = fill(catalogue, max_seconds, pool, rng)
+    return [catalogue.ids[row] for row in rows]
@@ -0,0 +1,288 @@
+"""Generating playlists from each account's pool of candidate songs, and saving them"""
+from bisect import bisect_right
+from array import array
+from datetime import date
+import struct
+import random
+import os
+
+from instrumentation import metrics
+from storage import file_lock
+from library import tokenize
+
+# The layout of a saved playlist's header: the length of the user's name in bytes, the
+# date it was saved (as an ordinal) and how many songs it has
+PLAYLIST_HEADER = struct.Struct("<Hiq")
+PLAYLIST_ID_TYPECODE = "q"
+PLAYLIST_ID_SIZE = 8
+
+# How many times more likely a song from the user's favourite genre, or by their
+# favourite artist, is to be picked (the two add up for songs that are both)
+GENRE_WEIGHT = 3
+ARTIST_WEIGHT = 5
+
+# How many random draws to allow for each song that a playlist is likely to need
+PLAYLIST_DRAWS_PER_SONG = 4
+
+# How many times best_fit_fill() goes through the playlist looking for better songs
+BEST_FIT_PASSES = 3
+
+
+class PlaylistStore:
+    """Saves playlists to a binary file, one record after another. Each record is a
+    header (PLAYLIST_HEADER) followed by the user's name and the playlist's song IDs as
+    an array. An index of every user's playlists, by date, is built by hopping from one
+    header to the next, and is kept up-to-date with records that other processes add."""
+
+    def __init__(self, filename):
+        self.filename = os.fspath(filename)
+        self.by_user = {}
+        self.indexed_size = 0
+
+    def refresh(self):
+        with file_lock(self.filename):
+            try:
+                size = os.path.getsize(self.filename)
+            except FileNotFoundError:
+                size = 0
+            if size < self.indexed_size:
+                # The file has been replaced, so index it from the start again
+                self.by_user = {}
+                self.indexed_size = 0
+            if size == self.indexed_size:
+                return self
+
+            with open(self.filename, "rb") as playlists_file:
+                offset = self.indexed_size
+                while offset + PLAYLIST_HEADER.size <= size:
+                    playlists_file.seek(offset)
+                    name_length, day, song_count = PLAYLIST_HEADER.unpack(
+                        playlists_file.read(PLAYLIST_HEADER.size)
+                    )
+                    name = playlists_file.read(name_length).decode()
+                    ids_offset = offset + PLAYLIST_HEADER.size + name_length
+                    record_end = ids_offset + song_count * PLAYLIST_ID_SIZE
+                    if record_end > size:
+                        break
+                    self.by_user.setdefault(name, []).append((day, ids_offset, song_count))
+                    offset = record_end
+            self.indexed_size = offset
+        return self
+
+    def save(self, username, song_ids, day=None):
+        day = (day or date.today()).toordinal()
+        name = username.encode()
+        ids = array(PLAYLIST_ID_TYPECODE, song_ids)
+        with file_lock(self.filename, exclusive=True):
+            self.refresh()
+            with open(self.filename, "ab") as playlists_file:
+                if playlists_file.seek(0, os.SEEK_END) > self.indexed_size:
+                    # refresh() stops at a record that a crashed writer didn't finish.
+                    # Nobody else can be writing now, so cut it off, or its header would
+                    # swallow this record.
+                    playlists_file.truncate(self.indexed_size)
+                    metrics.count("torn playlists removed")
+                playlists_file.write(PLAYLIST_HEADER.pack(len(name), day, len(ids)))
+                playlists_file.write(name)
+                playlists_file.write(ids.tobytes())
+            metrics.count(
+                "bytes written: playlists", PLAYLIST_HEADER.size + len(name) + len(ids) * ids.itemsize
+            )
+            self.refresh()
+
+    def playlists(self, username):
+        """Returns (date, offset, song count) for each of a user's playlists, newest first"""
+        entries = self.refresh().by_user.get(username, [])
+        return sorted(entries, key=lambda entry: (entry[0], entry[1]), reverse=True)
+
+    def song_ids(self, ids_offset, song_count):
+        ids = array(PLAYLIST_ID_TYPECODE)
+        with open(self.filename, "rb") as playlists_file:
+            playlists_file.seek(ids_offset)
+            ids.frombytes(playlists_file.read(song_count * PLAYLIST_ID_SIZE))
+        return ids
+
+
+class CandidatePool:
+    """The songs that an account's playlists are drawn from, as tiers of rows that each
+    add some weight to the songs in them: every song gets a weight of 1, songs in the
+    favourite genre get GENRE_WEIGHT - 1 more, and songs by the favourite artist get
+    ARTIST_WEIGHT - 1 more. Each tier is a slice of one of the library's indexes, so a
+    pool takes up almost no memory, and drawing a song from it is O(1) apart from a
+    bisect over the handful of slices."""
+
+    __slots__ = ("slices", "cumulative", "total")
+
+    def __init__(self, tiers):
+        self.slices = []
+        self.cumulative = []
+        total = 0
+        for weight, slices in tiers:
+            for rows, start, end in slices:
+                if end > start:
+                    total += weight * (end - start)
+                    self.slices.append((rows, start, end, weight))
+                    self.cumulative.append(total)
+        self.total = total
+
+    def __len__(self):
+        return len(self.slices)
+
+    def sample(self, rng=random):
+        """Picks a row from the pool, with each row's chance being proportional to its weight"""
+        point = rng.random() * self.total
+        index = bisect_right(self.cumulative, point)
+        rows, start, end, weight = self.slices[index]
+        previous = self.cumulative[index - 1] if index else 0
+        return rows[min(start + int((point - previous) / weight), end - 1)]
+
+
+class CandidatePools:
+    """Builds each account's CandidatePool from their favourite artist and genre, and
+    caches it until their profile changes (see forget()) or the library is reloaded."""
+
+    def __init__(self, library):
+        self.library = library
+        self.pools = {}
+        self.artist_words = {}
+        self.library_signature = None
+
+    def refresh(self):
+        library = self.library.refresh()
+        if library.file_signature != self.library_signature:
+            self.pools = {}
+            # Map each word in an artist's name to the artist codes, so that a favourite
+            # artist also matches their collaborations (e.g. "Bruno Mars" matches
+            # "Mark Ronson & Bruno Mars")
+            self.artist_words = {}
+            for code, name in enumerate(library.artist_names):
+                for word in set(tokenize(name)):
+                    self.artist_words.setdefault(word, set()).add(code)
+            self.library_signature = library.file_signature
+        return self
+
+    def artist_codes(self, favourite_artist):
+        words = tokenize(favourite_artist)
+        if not words:
+            return set()
+        codes = set(self.artist_words.get(words[0], ()))
+        for word in words[1:]:
+            codes &= self.artist_words.get(word, set())
+        return codes
+
+    def pool_for(self, account):
+        self.refresh()
+        profile = (account["favourite_artist"], account["favourite_genre"])
+        cached = self.pools.get(account["name"])
+        if cached and cached[0] == profile:
+            return cached[1]
+
+        library = self.library
+        tiers = [(1, [(library.length_order, 0, len(library))])]
+        genre_code = library.genre_lookup.get(account["favourite_genre"])
+        if genre_code is not None:
+            starts = library.genre_starts
+            tiers.append(
+                (GENRE_WEIGHT - 1, [(library.genre_rows, starts[genre_code], starts[genre_code + 1])])
+            )
+        starts = library.artist_starts
+        artist_slices = [
+            (library.artist_rows, starts[code], starts[code + 1])
+            for code in sorted(self.artist_codes(account["favourite_artist"]))
+        ]
+        if artist_slices:
+            tiers.append((ARTIST_WEIGHT - 1, artist_slices))
+
+        pool = CandidatePool(tiers)
+        self.pools[account["name"]] = (profile, pool)
+        return pool
+
+    def forget(self, username):
+        """Drops a user's cached pool, e.g. because they've changed their favourites"""
+        self.pools.pop(username, None)
+
+
+"""Fills up to max_seconds with songs drawn from a CandidatePool, so songs by the user's
+favourite artist and in their favourite genre are more likely to be picked. Each draw is
+O(1), so a playlist of k songs takes O(k) draws rather than a pass over the library.
+Songs that would make the playlist too long are skipped rather than ending the playlist,
+and any gap left at the end is topped up with the longest unused songs that still fit.
+Returns the rows of the chosen songs, in playlist order."""
+def random_fill(library, max_seconds, pool, rng=random):
+    library.refresh()
+    if len(library) == 0 or len(pool) == 0:
+        return []
+    lengths = library.lengths
+    sorted_lengths = library.sorted_lengths
+    shortest = sorted_lengths[0]
+    typical_length = max(1, sorted_lengths[len(sorted_lengths) // 2])
+    # A playlist can't have more songs than the library does, however long it's allowed
+    # to be, so the draws are capped by the library's size too
+    # (checking that first also copes with max_seconds being infinite)
+    if max_seconds >= typical_length * len(library):
+        song_count = len(library)
+    else:
+        song_count = int(max_seconds // typical_length + 1)
+    max_draws = PLAYLIST_DRAWS_PER_SONG * song_count
+
+    chosen = set()
+    playlist = []
+    remaining = max_seconds
+    for _ in range(max_draws):
+        if remaining < shortest or len(chosen) == len(library):
+            return playlist
+        row = pool.sample(rng)
+        if row in chosen or lengths[row] > remaining:
+            continue
+        chosen.add(row)
+        playlist.append(row)
+        remaining -= lengths[row]
+
+    # Random draws rarely fit into a small gap, so finish off with the length index
+    index = bisect_right(sorted_lengths, remaining) - 1
+    while index >= 0:
+        row = library.length_order[index]
+        if row not in chosen:
+            chosen.add(row)
+            playlist.append(row)
+            remaining -= lengths[row]
+            index = bisect_right(sorted_lengths, remaining, 0, index) - 1
+        else:
+            index -= 1
+    return playlist
+
+
+"""Fills up to max_seconds as closely as possible. It starts from a random_fill() playlist
+and then swaps songs for longer unused ones that still fit, using the library's length
+index, so the result is close to the best possible fill while staying varied."""
+def best_fit_fill(library, max_seconds, pool, rng=random):
+    playlist = random_fill(library, max_seconds, pool, rng)
+    lengths = library.lengths
+    candidates = library.length_range_rows(0, max_seconds)
+    candidate_lengths = library.sorted_lengths[: len(candidates)]
+    chosen = set(playlist)
+    remaining = max_seconds - sum(lengths[row] for row in playlist)
+
+    for _ in range(BEST_FIT_PASSES):
+        improved = False
+        for position, row in enumerate(playlist):
+            if remaining < 1:
+                return playlist
+            length = lengths[row]
+            # Look for the longest unused song that fits in this song's place
+            index = bisect_right(candidate_lengths, length + remaining) - 1
+            steps = 0
+            while index >= 0 and candidate_lengths[index] > length and steps < 64:
+                replacement = candidates[index]
+                if replacement not in chosen:
+                    chosen.remove(row)
+                    chosen.add(replacement)
+                    playlist[position] = replacement
+                    remaining -= candidate_lengths[index] - length
+                    improved = True
+                    break
+                index -= 1
+                steps += 1
+        if not improved:
+            break
+    return playlist
@@ -0,0 +1,182 @@
+"""Scripted mode, which runs commands from a file or stdin without showing any menus"""
+import shlex
+import sys
+import time
+import os
+
+from library import (
+    GENRES,
+    SEARCH_RESULT_COUNT,
+    parse_seconds,
+    format_song,
+    format_export,
+    export_format_for,
+)
+from ocrtunes import (
+    catalogue,
+    accounts,
+    candidate_pools,
+    playlists,
+    state,
+    get_account,
+    reload_user,
+    update_user,
+    build_playlist,
+)
+from menu import iso_date, parse_date, parse_minutes
+
+# How many commands' output run_script() collects before writing it to the terminal
+SCRIPT_OUTPUT_BATCH = 256
+
+"""The account that's logged in, for script commands that need one"""
+def script_user():
+    if "user" not in state:
+        raise LookupError("You need to log in first!")
+    return state["user"]
+
+
+def script_create(name, birth_date, favourite_artist, favourite_genre):
+    name = name.title()
+    if get_account(name):
+        raise ValueError(f'There\'s already an account called "{name}"!')
+    if favourite_genre.lower() not in GENRES:
+        raise ValueError(f"That's not a valid genre! Available genres: {', '.join(GENRES)}")
+    birth_date = parse_date(birth_date)
+    accounts.add(name, iso_date(birth_date), favourite_artist, favourite_genre.lower())
+    return f"Created account {name}"
+
+
+def script_login(*name):
+    username = " ".join(name).title()
+    matched_account = get_account(username)
+    if not matched_account:
+        raise LookupError(f'Could not find an account with the name "{username}"!')
+    state["user"] = matched_account
+    return f"Logged in to {username}"
+
+
+def script_logout():
+    state["old_user"] = script_user()["name"]
+    del state["user"]
+    return "Logged out"
+
+
+def script_edit(field, *value):
+    columns = {"artist": 2, "genre": 3}
+    if field not in columns:
+        raise ValueError("You can edit your favourite artist or genre")
+    value = " ".join(value)
+    if field == "genre":
+        value = value.lower()
+        if value not in GENRES:
+            raise ValueError(f"That's not a valid genre! Available genres: {', '.join(GENRES)}")
+    if not value:
+        raise ValueError(f"Enter your new favourite {field}")
+    script_user()
+    update_user(columns[field], value)
+    reload_user()
+    candidate_pools.forget(state["user"]["name"])
+    return f"Changed your favourite {field} to {value}"
+
+
+def script_generate(minutes, *options):
+    for option in options:
+        if option not in ("best-fit", "save"):
+            raise ValueError(f"Unknown option {option!r} (use best-fit and/or save)")
+    account = script_user()
+    playlist = build_playlist(account, parse_minutes(minutes) * 60, "best-fit" in options)
+    if "save" in options and playlist:
+        playlists.save(account["name"], playlist)
+    run_time = sum(catalogue.get(id)["length"] for id in playlist)
+    ids = ",".join(str(id) for id in playlist)
+    return f"{len(playlist)} songs ({parse_seconds(run_time)}): {ids}"
+
+
+def script_search(*query):
+    results = catalogue.search(" ".join(query), SEARCH_RESULT_COUNT)
+    return "\n".join(format_song(song) for song in results) or "No songs found"
+
+
+def script_export(artist, filename):
+    rows = catalogue.artist_song_rows(artist)
+    if len(rows) == 0:
+        raise LookupError(f'There aren\'t any songs with the artist "{artist}"!')
+    if os.path.exists(filename):
+        raise ValueError(f"Something already exists at {filename}!")
+    with open(filename, "w") as file:
+        file.write(format_export(catalogue.iter_songs(rows), export_format_for(filename)))
+    return f"Saved {len(rows)} song(s) to {filename}"
+
+
+# The commands that can be used in scripts (see run_script()), with the arguments they
+# take and the least and most number of arguments (None for no limit)
+SCRIPT_COMMANDS = {
+    "create": (script_create, "NAME BIRTH_DATE ARTIST GENRE", 4, 4),
+    "login": (script_login, "NAME", 1, None),
+    "logout": (script_logout, "", 0, 0),
+    "edit": (script_edit, "artist|genre VALUE", 2, None),
+    "generate": (script_generate, "MINUTES [best-fit] [save]", 1, 3),
+    "search": (script_search, "QUERY", 1, None),
+    "export": (script_export, "ARTIST FILENAME", 2, 2),
+}
+
+
+"""Runs one line of a script, and returns what it outputs"""
+def run_script_line(line):
+    words = shlex.split(line)
+    command, arguments = words[0].lower(), words[1:]
+    if command not in SCRIPT_COMMANDS:
+        raise ValueError(f"Unknown command {command!r}")
+    function, usage, least, most = SCRIPT_COMMANDS[command]
+    if len(arguments) < least or (most is not None and len(arguments) > most):
+        raise ValueError(f"Usage: {command} {usage}".strip())
+    return function(*arguments)
+
+
+"""Runs commands from a file (or stdin, if filename is "-"), one per line, without
+showing any menus. Each line is a command followed by its arguments, which can be
+quoted if they contain spaces, e.g. `export "Ed Sheeran" ed.m3u`. Blank lines and lines
+starting with # are skipped. Errors are reported (on stderr) without stopping the
+script. Returns the number of commands that failed."""
+def run_script(filename="-", quiet=False):
+    script = sys.stdin if filename == "-" else open(filename, "r")
+    catalogue.refresh()
+    accounts.refresh()
+    output = []
+    count = 0
+    failures = 0
+    start_time = time.perf_counter()
+    try:
+        for line_number, line in enumerate(script, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            count += 1
+            try:
+                result = run_script_line(line)
+            except (ValueError, LookupError, OSError) as error:
+                failures += 1
+                # Write the output so far first, so that the error shows up in the right place
+                sys.stdout.write("".join(output))
+                sys.stdout.flush()
+                output.clear()
+                print(f"Line {line_number}: {error}", file=sys.stderr)
+                continue
+            if not quiet and result:
+                output.append(result + "\n")
+                if len(output) >= SCRIPT_OUTPUT_BATCH:
+                    sys.stdout.write("".join(output))
+                    output.clear()
+    finally:
+        sys.stdout.write("".join(output))
+        sys.stdout.flush()
+        if script is not sys.stdin:
+            script.close()
+
+    elapsed = time.perf_counter() - start_time
+    rate = count / elapsed if elapsed else 0
+    print(
+        f"Ran {count} commands in {elapsed:.2f}s ({rate:.0f} commands/s), {failures} failed",
+        file=sys.stderr,
+    )
+    return failures
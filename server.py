@@ -0,0 +1,316 @@
+"""A local HTTP API for OCRtunes, built on asyncio so that one process can serve lots of
+clients at once. Every request shares the same in-memory song library.
+
+Usage: python server.py [--host 127.0.0.1] [--port 8080]
+
+Endpoints:
+    GET   /songs?sort=title&offset=0&limit=50   List the library in a sort order
+    GET   /songs/search?q=...&limit=10          Search titles and artists
+    GET   /songs/<id>                           Look up one song
+    GET   /accounts/<name>                      Look up an account
+    PATCH /accounts/<name>                      Change favourite_artist/favourite_genre
+    POST  /playlists                            Generate a playlist: {"name", "minutes",
+                                                "best_fit" (optional), "seed" (optional)}
+    GET   /artists/<artist>/export?format=txt   Export an artist's songs (txt/jsonl/m3u)
+"""
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs, unquote
+import asyncio
+import json
+import math
+import random
+import re
+
+import library
+import ocrtunes
+
+MAX_HEADER_LINES = 100
+MAX_BODY_SIZE = 1024 * 1024
+MAX_PAGE_SIZE = 1000
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+# The columns of accounts.csv that can be changed through the API, and the characters
+# that they can't contain (accounts.csv is read one line per account)
+EDITABLE_COLUMNS = {"favourite_artist": 2, "favourite_genre": 3}
+CONTROL_CHARACTER_PATTERN = re.compile(r"[\x00-\x1f\x7f]")
+
+# The longest playlist that can be asked for, in minutes (about 10 weeks)
+MAX_PLAYLIST_MINUTES = 100_000
+
+blocking_executor = ThreadPoolExecutor(max_workers=1)
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def song_json(song):
+    return dict(song)
+
+
+def int_parameter(query, name, default, maximum=None):
+    try:
+        value = int(query.get(name, [default])[0])
+    except ValueError:
+        raise HTTPError(400, f"{name} must be a whole number")
+    if value < 0:
+        raise HTTPError(400, f"{name} can't be negative")
+    return min(value, maximum) if maximum is not None else value
+
+
+def list_songs(request):
+    query = request["query"]
+    order = query.get("sort", ["title"])[0]
+    if order not in library.SORT_ORDERS:
+        raise HTTPError(400, f"sort must be one of: {', '.join(library.SORT_ORDERS)}")
+    offset = int_parameter(query, "offset", 0)
+    limit = int_parameter(query, "limit", 50, MAX_PAGE_SIZE)
+
+    rows = ocrtunes.catalogue.sorted_rows(order)
+    songs = ocrtunes.catalogue.iter_songs(rows[offset : offset + limit])
+    return 200, {"total": len(rows), "songs": [song_json(song) for song in songs]}
+
+
+def search_songs(request):
+    query = request["query"]
+    text = query.get("q", [""])[0]
+    if not text.strip():
+        raise HTTPError(400, "q is required")
+    limit = int_parameter(query, "limit", library.SEARCH_RESULT_COUNT, MAX_PAGE_SIZE)
+    return 200, {"songs": [song_json(song) for song in ocrtunes.catalogue.search(text, limit)]}
+
+
+def get_song(request, id):
+    try:
+        return 200, song_json(ocrtunes.catalogue.get(int(id)))
+    except LookupError as error:
+        raise HTTPError(404, str(error))
+
+
+def get_account(request, name):
+    account = ocrtunes.get_account(name)
+    if not account:
+        raise HTTPError(404, f'Couldn\'t find an account with the name "{name}"')
+    return 200, account
+
+
+def update_account(request, name):
+    changes = request["json"]
+    if not isinstance(changes, dict) or not changes:
+        raise HTTPError(400, "Send a JSON object of the fields to change")
+    for field, value in changes.items():
+        if field not in EDITABLE_COLUMNS:
+            raise HTTPError(400, f"{field} can't be changed")
+        if not isinstance(value, str) or not value:
+            raise HTTPError(400, f"{field} must be a non-empty string")
+        if CONTROL_CHARACTER_PATTERN.search(value):
+            raise HTTPError(400, f"{field} can't contain line breaks or control characters")
+        if field == "favourite_genre" and value not in library.GENRES:
+            raise HTTPError(400, f"favourite_genre must be one of: {', '.join(library.GENRES)}")
+
+    try:
+        for field, value in changes.items():
+            ocrtunes.update_account(name, EDITABLE_COLUMNS[field], value)
+    except LookupError:
+        raise HTTPError(404, f'Couldn\'t find an account with the name "{name}"')
+    ocrtunes.candidate_pools.forget(name)
+    return 200, ocrtunes.get_account(name)
+
+
+def create_playlist(request):
+    body = request["json"]
+    if not isinstance(body, dict):
+        raise HTTPError(400, "Send a JSON object")
+    account = ocrtunes.get_account(str(body.get("name", "")))
+    if not account:
+        raise HTTPError(404, "Couldn't find an account with that name")
+    minutes = body.get("minutes")
+    # JSON allows NaN and Infinity, and True would count as an int
+    if (
+        not isinstance(minutes, (int, float))
+        or isinstance(minutes, bool)
+        or not math.isfinite(minutes)
+        or not 0 < minutes <= MAX_PLAYLIST_MINUTES
+    ):
+        raise HTTPError(400, f"minutes must be a number from 0 to {MAX_PLAYLIST_MINUTES}")
+
+    seed = body.get("seed")
+    if seed is not None and (not isinstance(seed, (int, str)) or isinstance(seed, bool)):
+        raise HTTPError(400, "seed must be a whole number or a string")
+    rng = random.Random(seed) if seed is not None else random
+    playlist = ocrtunes.build_playlist(account, minutes * 60, bool(body.get("best_fit")), rng)
+    songs = ocrtunes.catalogue.get_many(playlist)
+    return 200, {
+        "ids": playlist,
+        "run_time": sum(song["length"] for song in songs),
+        "songs": [song_json(song) for song in songs],
+    }
+
+
+def export_artist(request, artist):
+    format = request["query"].get("format", ["txt"])[0]
+    if format not in library.EXPORT_FORMATS:
+        raise HTTPError(400, f"format must be one of: {', '.join(library.EXPORT_FORMATS)}")
+    rows = ocrtunes.catalogue.artist_song_rows(artist)
+    if len(rows) == 0:
+        raise HTTPError(404, "There aren't any songs with that artist")
+    return 200, library.format_export(ocrtunes.catalogue.iter_songs(rows), format)
+
+
+# Each route is (method, path pattern, handler). Every handler is run in one worker
+# thread, rather than on the event loop, because they can block: reloading library.csv
+# parses it and waits for file locks, and the account store reads and writes its files.
+# There's only one worker, because neither the song library nor the account store is
+# safe to change from two threads at once (and most requests only take a moment anyway).
+ROUTES = [
+    ("GET", re.compile(r"/songs"), list_songs),
+    ("GET", re.compile(r"/songs/search"), search_songs),
+    ("GET", re.compile(r"/songs/(\d+)"), get_song),
+    ("GET", re.compile(r"/accounts/([^/]+)"), get_account),
+    ("PATCH", re.compile(r"/accounts/([^/]+)"), update_account),
+    ("POST", re.compile(r"/playlists"), create_playlist),
+    ("GET", re.compile(r"/artists/([^/]+)/export"), export_artist),
+]
+
+
+async def dispatch(request):
+    allowed = False
+    for method, pattern, handler in ROUTES:
+        match = pattern.fullmatch(request["path"])
+        if not match:
+            continue
+        allowed = True
+        if method != request["method"]:
+            continue
+        parameters = [unquote(group) for group in match.groups()]
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            blocking_executor, lambda: handler(request, *parameters)
+        )
+
+    if allowed:
+        raise HTTPError(405, f"{request['method']} isn't allowed here")
+    raise HTTPError(404, f"Nothing found at {request['path']}")
+
+
+async def read_request(reader):
+    """Reads one request from a connection. Returns None once the client has finished."""
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    try:
+        method, target, version = request_line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+
+    headers = {}
+    for _ in range(MAX_HEADER_LINES):
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise HTTPError(400, "Too many headers")
+
+    try:
+        length = int(headers.get("content-length", 0) or 0)
+    except ValueError:
+        raise HTTPError(400, "Content-Length must be a number")
+    if length > MAX_BODY_SIZE:
+        raise HTTPError(413, "Request body is too large")
+    body = await reader.readexactly(length) if length else b""
+
+    url = urlsplit(target)
+    request = {
+        "method": method.upper(),
+        "path": url.path.rstrip("/") or "/",
+        "query": parse_qs(url.query),
+        "headers": headers,
+        "keep_alive": version == "HTTP/1.1" and headers.get("connection") != "close",
+        "json": None,
+    }
+    if body:
+        try:
+            request["json"] = json.loads(body)
+        except ValueError:
+            raise HTTPError(400, "The request body isn't valid JSON")
+    return request
+
+
+def encode_response(status, payload, keep_alive):
+    if isinstance(payload, str):
+        body = payload.encode()
+        content_type = "text/plain; charset=utf-8"
+    else:
+        body = json.dumps(payload).encode()
+        content_type = "application/json"
+    head = (
+        f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    return head.encode() + body
+
+
+async def handle_connection(reader, writer):
+    try:
+        while True:
+            keep_alive = False
+            try:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                keep_alive = request["keep_alive"]
+                status, payload = await dispatch(request)
+            except HTTPError as error:
+                status, payload = error.status, {"error": error.message}
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            except Exception as error:
+                status, payload = 500, {"error": f"{type(error).__name__}: {error}"}
+
+            writer.write(encode_response(status, payload, keep_alive))
+            await writer.drain()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host, port):
+    # Load everything up-front (on the handlers' thread), so the first clients don't wait for it
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(blocking_executor, ocrtunes.catalogue.refresh)
+    await loop.run_in_executor(blocking_executor, ocrtunes.accounts.refresh)
+    server = await asyncio.start_server(handle_connection, host, port, backlog=4096)
+    print(f"Serving OCRtunes on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the OCRtunes HTTP API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    arguments = parser.parse_args()
+    try:
+        asyncio.run(serve(arguments.host, arguments.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,160 @@
+"""Running scans over the song library on a pool of worker processes, for the queries
+that can't be answered from one of the library's indexes and so have to look at every
+song in a range: filtering out a set of song IDs, and adding up lengths by genre or
+artist. Small scans are still run in this process, because handing work to the pool
+has a fixed cost (see PARALLEL_SCAN_THRESHOLD, which OCRTUNES_SCAN_THRESHOLD overrides)."""
+from array import array
+import os
+
+from instrumentation import metrics
+
+# Scans of fewer rows than this are run in this process. This default is provisional:
+# it hasn't been measured on a multi-core host yet. It's an estimate from the cost of
+# handing a scan to the pool (1-3 ms, as long as this process takes to scan about
+# 10,000 rows), with room to spare. The only measurement so far was on a machine with
+# one CPU, where the pool can't win, and it broke even at about 1,000,000 rows. Run
+# benchmarks/parallel_scan.py on the machine that OCRtunes runs on, and set the
+# OCRTUNES_SCAN_THRESHOLD environment variable to the crossover that it reports.
+PARALLEL_SCAN_THRESHOLD = 100_000
+
+# The columns of codes that totals() can group songs by, and the names for the codes
+GROUP_COLUMNS = {
+    "genre": ("genre_codes", "genre_names"),
+    "artist": ("artist_codes", "artist_names"),
+}
+
+# The library in each worker process, which is given to it when the pool starts
+worker_library = None
+
+
+"""Returns the threshold set by OCRTUNES_SCAN_THRESHOLD, or PARALLEL_SCAN_THRESHOLD"""
+def scan_threshold():
+    try:
+        return int(os.environ["OCRTUNES_SCAN_THRESHOLD"])
+    except (KeyError, ValueError):
+        return PARALLEL_SCAN_THRESHOLD
+
+
+def start_worker(library):
+    global worker_library
+    worker_library = library
+
+
+"""Runs a scan over one shard in a worker process. Returns None if the worker's copy of
+the library isn't from the same version of the file as the one the scan was planned with."""
+def scan_shard(signature, scan, index, start, end, arguments):
+    library = worker_library.refresh()
+    if library.file_signature != signature:
+        return None
+    rows = getattr(library, index)[start:end] if index else range(start, end)
+    return scan(library, rows, *arguments)
+
+
+"""Returns the rows whose song IDs aren't in exclude, in the same order"""
+def exclude_rows(library, rows, exclude):
+    ids = library.ids
+    return array("l", [row for row in rows if ids[row] not in exclude])
+
+
+"""Counts the songs in rows, and adds up their lengths, for each code in a column of
+codes (e.g. each genre). Returns (counts, seconds), which are both indexed by code."""
+def add_up_lengths(library, rows, group):
+    column, names = GROUP_COLUMNS[group]
+    codes = getattr(library, column)
+    lengths = library.lengths
+    counts = [0] * len(getattr(library, names))
+    seconds = [0] * len(counts)
+    for row in rows:
+        code = codes[row]
+        counts[code] += 1
+        seconds[code] += lengths[row]
+    return counts, seconds
+
+
+class LibraryShards:
+    """Splits big scans over a SongLibrary into one shard for each worker process, and
+    merges the shards' results back together in order. A scan covers a range of one of
+    the library's indexes (e.g. the songs of a length range, from length_order), or a
+    range of rows, which is the same as a range of IDs when the CSV file is in ID order.
+
+    Each worker has its own copy of the library, which it refreshes before each scan,
+    so that it keeps up with changes to the file. The pool is started the first time a
+    scan is big enough to need it, so small libraries never start one."""
+
+    def __init__(self, library, workers=None, threshold=None):
+        self.library = library
+        self.workers = workers or os.cpu_count() or 1
+        self.threshold = scan_threshold() if threshold is None else threshold
+        self.executor = None
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def shard_bounds(self, start, end):
+        count = self.workers
+        size = end - start
+        return [
+            (start + size * shard // count, start + size * (shard + 1) // count)
+            for shard in range(count)
+        ]
+
+    def scan(self, scan, index, start, end, *arguments):
+        """Runs scan(library, rows, *arguments) over getattr(library, index)[start:end], or
+        over the rows from start to end if index is None. Returns each shard's result, in
+        order. The library should already have been refreshed."""
+        library = self.library
+        if self.workers > 1 and end - start >= self.threshold:
+            if self.executor is None:
+                from concurrent.futures import ProcessPoolExecutor
+
+                # Forked workers share this process's copy of the library until they
+                # need to reload it
+                self.executor = ProcessPoolExecutor(
+                    self.workers, initializer=start_worker, initargs=(library,)
+                )
+            futures = [
+                self.executor.submit(
+                    scan_shard, library.file_signature, scan, index, shard_start, shard_end, arguments
+                )
+                for shard_start, shard_end in self.shard_bounds(start, end)
+            ]
+            results = [future.result() for future in futures]
+            if not any(result is None for result in results):
+                metrics.count("parallel scans")
+                metrics.count("rows scanned: parallel", end - start)
+                return results
+
+        rows = getattr(library, index)[start:end] if index else range(start, end)
+        metrics.count("rows scanned: in-process", end - start)
+        return [scan(library, rows, *arguments)]
+
+    def rows_in_range(self, min_length=0, max_length=None, genre=None, exclude=()):
+        """Like SongLibrary.length_range_rows(), but leaves out the songs whose IDs are in
+        exclude (a set or SongBitmap), checking big ranges in parallel"""
+        index, start, end = self.library.length_range(min_length, max_length, genre)
+        if not exclude:
+            return getattr(self.library, index)[start:end]
+        rows = array("l")
+        for shard_rows in self.scan(exclude_rows, index, start, end, exclude):
+            rows.extend(shard_rows)
+        return rows
+
+    def songs_in_range(self, min_length=0, max_length=None, genre=None, exclude=()):
+        return self.library.songs(self.rows_in_range(min_length, max_length, genre, exclude))
+
+    def totals(self, group="genre"):
+        """Returns {name: (number of songs, total length in seconds)} for each genre or
+        artist in the library. The library is split into shards by row."""
+        library = self.library.refresh()
+        names = getattr(library, GROUP_COLUMNS[group][1])
+        counts = [0] * len(names)
+        seconds = [0] * len(names)
+        for shard_counts, shard_seconds in self.scan(add_up_lengths, None, 0, len(library), group):
+            for code in range(len(names)):
+                counts[code] += shard_counts[code]
+                seconds[code] += shard_seconds[code]
+        return {
+            name: (counts[code], seconds[code]) for code, name in enumerate(names) if counts[code]
+        }
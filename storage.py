@@ -0,0 +1,74 @@
+"""Helpers for the CSV data files: writing records, and locking files so that several
+OCRtunes processes can share them"""
+from contextlib import contextmanager
+import threading
+import os
+
+try:
+    import fcntl
+except ImportError:
+    # File locking isn't available on Windows, where OCRtunes only supports one process
+    fcntl = None
+
+
+def new_record(*columns):
+    record = ",".join([str(column) for column in columns])
+    return record + "\n"
+
+
+def get_file(filename):
+    try:
+        return open(filename, "r")
+    except FileNotFoundError:
+        # Create the file if it doesn't exist
+        file = open(filename, "w")
+        file.close()
+        return open(filename, "r")
+
+
+"""Locks that each thread is holding, in the form {lock path: [lock file, exclusive, depth]}.
+They're tracked per thread so that another thread's lock isn't mistaken for a nested one."""
+held_locks = threading.local()
+
+
+"""Holds a lock on the file at path (using a separate .lock file) for the duration of a
+with block. Shared locks are for reading and don't block each other, while an exclusive
+lock is for writing and waits until nobody else has the file locked. Locks can be nested
+within a process, as long as a shared lock isn't upgraded to an exclusive one."""
+@contextmanager
+def file_lock(path, exclusive=False):
+    lock_path = os.path.abspath(path) + ".lock"
+    locks = held_locks.__dict__
+    held = locks.get(lock_path)
+    if held:
+        if exclusive and not held[1]:
+            raise RuntimeError(f"Cannot upgrade a shared lock on {path} to an exclusive one!")
+        held[2] += 1
+        try:
+            yield
+        finally:
+            held[2] -= 1
+        return
+
+    lock_file = open(lock_path, "a")
+    if fcntl:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+    locks[lock_path] = [lock_file, exclusive, 1]
+    try:
+        yield
+    finally:
+        del locks[lock_path]
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+
+"""Works out the SHA-256 hash of a file's contents"""
+def file_digest(filename):
+    import hashlib
+
+    digest = hashlib.sha256()
+    with open(filename, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.digest()